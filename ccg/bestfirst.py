@@ -0,0 +1,98 @@
+"""
+Best-first (A*) parsing: an alternative to chartparser.parse that
+builds items cheapest-first from an agenda, rather than cell by cell,
+so that it can stop as soon as it finds the best complete parse.
+"""
+
+import heapq
+import itertools
+
+from chartcell import Cell
+import chartparser
+import rules
+import scoring
+
+
+def outside_estimates(chart, nwds, score):
+    """Maps each span (i,j) to a lower bound on the cost of the words
+       outside it: the cheapest lexical entry for each of those words.
+       As long as costs are nonnegative, every derivation pays at least
+       this much to cover them, so the estimate never overestimates."""
+    cheapest = [min((score(item, item.why) for item in chart[(i, i)]),
+                    default=0)
+                for i in range(nwds)]
+    before = list(itertools.accumulate([0] + cheapest))
+    return {(i, j): before[i] + before[nwds] - before[j + 1]
+            for i in range(nwds) for j in range(i, nwds)}
+
+
+def iter_best(wds, lexicon=chartparser.LEXICON, goal_category=None,
+              score=scoring.derivation_size, rules=rules.parsingRules):
+    """Yields the complete parses of the given words, optionally only
+       those whose category matches goal_category, cheapest first
+       according to the score function (see scoring).
+       Items come off a priority agenda ordered by their cost plus an
+       estimate of the cost of the rest of the sentence, and are only
+       combined with their neighbours once they do, so parsing stops
+       as soon as the caller has read as many parses as it wants."""
+    nwds = len(wds)
+    if nwds == 0:
+        return
+    unaryRules, binaryRules = rules
+    lexical = chartparser.mkChart(wds, lexicon)
+    outside = outside_estimates(lexical, nwds, score)
+    # The items that have come off the agenda, and their costs
+    chart = {(i, j): Cell() for i in range(nwds) for j in range(i, nwds)}
+    costs = {}
+    agenda = []
+    counter = itertools.count()
+
+    def push(item, i, j, cost, unary):
+        heapq.heappush(agenda, (cost + outside[(i, j)], next(counter),
+                                cost, item, i, j, unary))
+
+    def combine(cell1, cell2, i, j):
+        for binaryRule, item1, item2 in \
+                chartparser.candidate_pairs(cell1, cell2, binaryRules):
+            results = []
+            binaryRule(item1, item2, results)
+            for result in results:
+                push(result, i, j,
+                     costs[id(item1)] + costs[id(item2)] +
+                     score(result, result.why),
+                     False)
+
+    for i in range(nwds):
+        for item in lexical[(i, i)]:
+            push(item, i, i, score(item, item.why), False)
+
+    while agenda:
+        _, _, cost, item, i, j, unary = heapq.heappop(agenda)
+        chart[(i, j)].append(item)
+        costs[id(item)] = cost
+        if i == 0 and j == nwds - 1 and \
+           (goal_category is None or
+                item.cat.sub_unify(goal_category) is not None):
+            yield item
+        # As in chartparser.fillCell, unary rules are not applied to
+        # the results of unary rules.
+        if not unary:
+            for unaryRule in unaryRules:
+                results = []
+                unaryRule(item, results)
+                for result in results:
+                    push(result, i, j,
+                         cost + score(result, result.why), True)
+        # Combine with the neighbouring items already off the agenda
+        single = Cell([item])
+        for k in range(i):
+            combine(chart[(k, i - 1)], single, k, j)
+        for k in range(j + 1, nwds):
+            combine(single, chart[(j + 1, k)], i, k)
+
+
+def parse_best(wds, lexicon=chartparser.LEXICON, goal_category=None,
+               score=scoring.derivation_size, rules=rules.parsingRules):
+    """Returns the cheapest complete parse of the given words (see
+       iter_best), or None if there is none."""
+    return next(iter_best(wds, lexicon, goal_category, score, rules), None)
@@ -3,10 +3,13 @@ CCG Categories.
 """
 
 import collections
+import pickle
 import pyrsistent
+import re
 import slash
 import semantic_types
 import semantics
+import weakref
 
 def extend_pmap(pmap1, map2):
     return pyrsistent.pmap(
@@ -14,6 +17,66 @@ def extend_pmap(pmap1, map2):
     ).update(map2)
 
 
+def canonical_form(cat):
+    """A hashable stand-in for a category (or attribute) that is the same
+       for alpha-equivalent ones (see canonical_parts)"""
+    return canonical_parts(cat)[0]
+
+
+def canonical_parts(cat):
+    """The canonical form of a category (or attribute) and the ids of
+       its metavariables, in order of first occurrence. In the form,
+       the metavariables of a base category are numbered in that order
+       (de Bruijn style), and a slash category has the forms of its
+       parts and, for each metavariable of the domain, its number in
+       the whole; so open categories can keep theirs and build them
+       from those of their parts."""
+    if isinstance(cat, Metavar):
+        return 0, (id(cat),)
+    elif isinstance(cat, Attr) or cat.closed:
+        return cat, ()
+    return cat.canonical
+
+
+def combine_metavars(mvs1, mvs2):
+    """The metavariable ids of mvs1 followed by the new ones of mvs2,
+       and the position in the result of each one of mvs2"""
+    numbering = {mv: n for n, mv in enumerate(mvs1)}
+    for mv in mvs2:
+        numbering.setdefault(mv, len(numbering))
+    return tuple(numbering), tuple(numbering[mv] for mv in mvs2)
+
+
+CategoryInfo = collections.namedtuple(
+    'CategoryInfo', ['arity', 'args', 'result', 'semty', 'closed', 'shape'])
+CategoryInfo.__doc__ = \
+    """Facts about a category that rules and indexes look up often
+       (see the info property of categories): the number of arguments
+       it takes, and those arguments as (slash, category) pairs,
+       outermost first; the final result, once they have all been
+       taken; its semantic type; whether it is closed; and a shape
+       that, unlike the shape attribute, also tells leftward,
+       rightward and undirected functions apart."""
+
+
+def category_info(cat):
+    """Computes the CategoryInfo of a category"""
+    if isinstance(cat, SlashCategory):
+        cod = cat.cod.info
+        dom = cat.dom.info
+        if cod.shape is None or dom.shape is None:
+            shape = None
+        else:
+            shape = hash((cod.shape, cat.slash.dir, dom.shape))
+        return CategoryInfo(cod.arity + 1,
+                            ((cat.slash, cat.dom),) + cod.args,
+                            cod.result,
+                            semantic_types.ArrowType(dom.semty, cod.semty),
+                            cat.closed,
+                            shape)
+    return CategoryInfo(0, (), cat, cat.semty, cat.closed, cat.shape)
+
+
 class Attr:
     __slots__ = ('__value')
 
@@ -52,11 +115,18 @@ class Attr:
 class Metavar:
     """An unknown value"""
 
-    __slots__ = ('__hint', 'shape')
+    __slots__ = ('__hint', 'shape', '__info')
 
     def __init__(self, hint):
         self.__hint = hint
         self.shape = None
+        self.__info = None
+
+    @property
+    def info(self):
+        if self.__info is None:
+            self.__info = category_info(self)
+        return self.__info
 
     @property
     def hint(self):
@@ -71,6 +141,10 @@ class Metavar:
         else:
             return mv_to_string(self)
 
+    @property
+    def alpha_string(self):
+        return self.__hint
+
     def __hash__(self):
         return 42   # To make sure that T/T and U/U have the same
                    #  hash value, given that == does alpha-equivalence
@@ -148,20 +222,78 @@ class Metavar:
 
 class BaseCategory:
     """An atomic grammatical category, such as NP,
-       with optional fixed attributes"""
-
-    __slots__ = ('__cat', '__attrs', '__semty',
-                 '__hash', 'shape')
-
-    def __init__(self, cat, semty, attrs=pyrsistent.m()):
+       with optional fixed attributes.
+       Closed categories (with no metavariable attributes) are interned:
+       constructing an existing one returns the same object."""
+
+    __slots__ = ('__cat', '__attrs', '__semty', '__closed', '__mask',
+                 '__hash', 'shape', '__info', '__string', '__alpha_string',
+                 '__sort_key', '__canonical', '__weakref__')
+
+    # The closed base categories currently in use
+    __interned = weakref.WeakValueDictionary()
+
+    # Gives each (key, value) attribute pair seen so far its own bit,
+    #  so that the attributes of a closed category fit in an int mask
+    __bits = {}
+
+    def __new__(cls, cat, semty, attrs=pyrsistent.m()):
+        closed = not any(isinstance(a, Metavar) for a in attrs.values())
+        if closed:
+            key = (cat, semty, attrs)
+            self = BaseCategory.__interned.get(key)
+            if self is not None:
+                return self
+        self = super().__new__(cls)
         self.__cat = cat
         self.__semty = semty
         self.__attrs = attrs
-        self.__hash = hash((cat, attrs))
+        self.__closed = closed
+        self.__mask = BaseCategory.__mask_of(attrs) if closed else None
+        self.__info = None
+        self.__string = None
+        self.__alpha_string = None
+        self.__sort_key = None
+        if closed:
+            self.__canonical = None
+            self.__hash = hash((cat, attrs))
+        else:
+            # distinguish, e.g., NP[X,X] from NP[X,Y]
+            mvs = ()
+            form = []
+            for k, v in sorted(attrs.items(), key=lambda kv: kv[0]):
+                if isinstance(v, Metavar):
+                    mvs, (v,) = combine_metavars(mvs, (id(v),))
+                form.append((k, v))
+            self.__canonical = ((cat, tuple(form)), mvs)
+            self.__hash = hash(self.__canonical[0])
         self.shape = hash(cat)
         assert(not(isinstance(attr, str)) for attr in attrs.values())
+        if closed:
+            BaseCategory.__interned[key] = self
+        return self
+
+    def __reduce__(self):
+        # Rebuild through __new__, so that unpickled categories
+        # are interned too.
+        return (BaseCategory, (self.__cat, self.__semty, self.__attrs))
+
+    @staticmethod
+    def __mask_of(attrs):
+        bits = BaseCategory.__bits
+        mask = 0
+        for pair in attrs.items():
+            mask |= 1 << bits.setdefault(pair, len(bits))
+        return mask
 
     def __str__(self, mv_to_string=None):
+        if mv_to_string is None:
+            if self.__string is None:
+                self.__string = self.__format(None)
+            return self.__string
+        return self.__format(mv_to_string)
+
+    def __format(self, mv_to_string):
         if self.__attrs:
             values_s = [attr.__str__(mv_to_string)
                         for attr in self.__attrs.values()]
@@ -169,6 +301,28 @@ class BaseCategory:
         else:
             return self.__cat
 
+    @property
+    def alpha_string(self):
+        """See alpha_normalized_string"""
+        if self.__alpha_string is None:
+            self.__alpha_string = str(self) if self.__closed \
+                else self.__format(alpha_namer())
+        return self.__alpha_string
+
+    @property
+    def sort_key(self):
+        """See sort_key"""
+        if self.__sort_key is None:
+            self.__sort_key = string_sort_key(str(self))
+        return self.__sort_key
+
+    @property
+    def canonical(self):
+        """See canonical_parts"""
+        if self.__canonical is None:
+            return self, ()
+        return self.__canonical
+
     def __repr__(self):
         if self.__attrs:
             return \
@@ -194,12 +348,28 @@ class BaseCategory:
 
     @property
     def closed(self):
-        return not any(isinstance(a, Metavar) for a in self.__attrs.values())
+        return self.__closed
+
+    @property
+    def attr_mask(self):
+        """The attributes of a closed category, one bit for each
+           (key, value) pair; None if the category is not closed."""
+        return self.__mask
+
+    @property
+    def info(self):
+        if self.__info is None:
+            self.__info = category_info(self)
+        return self.__info
 
     def with_parens(self, mv_to_string=None):
         return self.__str__(mv_to_string)
 
     def __eq__(self, other, mvs_l=None, mvs_r=None):
+        if self is other and (self.__closed or mvs_l is None):
+            # Inside a larger open category, a shared subterm must still
+            # record its metavariables in mvs_l and mvs_r.
+            return True
         return (isinstance(other, BaseCategory) and
                 self.__cat == other.__cat and
                 len(self.__attrs) == len(other.__attrs) and
@@ -221,6 +391,10 @@ class BaseCategory:
             if self.__cat != other.__cat:
                 return None
 
+            if self.__closed and other.__closed:
+                # all of the other's attributes must be ours
+                return sub if other.__mask & ~self.__mask == 0 else None
+
             for k, v in other.__attrs.items():
                 if k not in self.__attrs.keys():
                     return None
@@ -231,7 +405,7 @@ class BaseCategory:
             return None
 
     def subst(self, sub):
-        if self.closed:
+        if self.__closed:
             return self
         else:
             return BaseCategory(self.__cat, self.__semty,
@@ -245,15 +419,20 @@ class SingletonCategory:
     """A category containing a specific word(s) with
        no interesting semantics"""
 
-    __slots__ = ('__word', 'shape')
+    __slots__ = ('__word', 'shape', '__info')
 
     def __init__(self, word):
         self.__word = word
         self.shape = hash(word)
+        self.__info = None
 
     def __str__(self, mv_to_string=None):
         return f'"{self.__word}"'
 
+    @property
+    def alpha_string(self):
+        return str(self)
+
     def __repr__(self):
         return f'SingletonCategory({self.__word!r})'
 
@@ -286,6 +465,12 @@ class SingletonCategory:
     def closed(self):
         return True
 
+    @property
+    def info(self):
+        if self.__info is None:
+            self.__info = category_info(self)
+        return self.__info
+
     def sub_unify(self, other, sub=pyrsistent.m()):
         if sub is None:
             # Short-circuit after failure in chained unifications.
@@ -308,18 +493,46 @@ class SingletonCategory:
 
 class SlashCategory:
     """A complex grammatical category,
-       with a given codomain, domain, and slash"""
+       with a given codomain, domain, and slash.
+       Closed categories are interned, like closed BaseCategories."""
 
-    __slots__ = ('__slash', '__cod', '__dom',
-                 '__closed', '__hash', 'shape')
+    __slots__ = ('__slash', '__cod', '__dom', '__closed', '__hash', 'shape',
+                 '__info', '__string', '__alpha_string', '__sort_key',
+                 '__canonical', '__weakref__')
 
-    def __init__(self, cod, sl, dom):
+    # The closed slash categories currently in use
+    __interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, cod, sl, dom):
         assert isinstance(sl, slash.Slash)
+        closed = cod.closed and dom.closed
+        if closed:
+            key = (cod, sl, dom)
+            self = SlashCategory.__interned.get(key)
+            if self is not None:
+                return self
+        self = super().__new__(cls)
         self.__slash = sl
         self.__cod = cod
         self.__dom = dom
-        self.__closed = cod.closed and dom.closed
-        self.__hash = hash((cod, sl, dom))
+        self.__closed = closed
+        self.__info = None
+        self.__string = None
+        self.__alpha_string = None
+        self.__sort_key = None
+        if closed:
+            self.__canonical = None
+            self.__hash = hash((cod, sl, dom))
+        else:
+            # Hashing the parts alone would treat every metavariable
+            #  alike (see Metavar.__hash__), so that, e.g., all of X/X,
+            #  X/Y, X\X/X and X\Y/Z would collide; the link says which
+            #  metavariables of the domain are those of the codomain.
+            cod_form, cod_mvs = canonical_parts(cod)
+            dom_form, dom_mvs = canonical_parts(dom)
+            mvs, link = combine_metavars(cod_mvs, dom_mvs)
+            self.__canonical = ((cod_form, sl, dom_form, link), mvs)
+            self.__hash = hash((hash(cod), sl, hash(dom), link))
         if cod.shape is None or dom.shape is None:
             self.shape = None
         else:
@@ -330,6 +543,12 @@ class SlashCategory:
             #  the complexity of a separate ALLOW_UNDIRECTED_SLASHES flag
             #  to specify whether we must ignore direction or not.
             self.shape = hash((cod.shape, dom.shape))
+        if closed:
+            SlashCategory.__interned[key] = self
+        return self
+
+    def __reduce__(self):
+        return (SlashCategory, (self.__cod, self.__slash, self.__dom))
 
     def __hash__(self):
         return self.__hash
@@ -350,12 +569,25 @@ class SlashCategory:
     def closed(self):
         return self.__closed
 
+    @property
+    def info(self):
+        if self.__info is None:
+            self.__info = category_info(self)
+        return self.__info
+
     def __repr__(self):
         return f'SlashCategory({self.__cod!r},' \
                f'{self.__slash!r},' \
                f'{self.__dom!r}'
 
     def __str__(self, mv_to_string=None):
+        if mv_to_string is None:
+            if self.__string is None:
+                self.__string = self.__format(None)
+            return self.__string
+        return self.__format(mv_to_string)
+
+    def __format(self, mv_to_string):
         answer = f'{self.__cod.__str__(mv_to_string)}' \
             f'{self.__slash}' \
                  f'{self.__dom.with_parens(mv_to_string)}'
@@ -363,15 +595,42 @@ class SlashCategory:
         #     answer = "..."
         return answer
 
+    @property
+    def alpha_string(self):
+        """See alpha_normalized_string"""
+        if self.__alpha_string is None:
+            self.__alpha_string = str(self) if self.__closed \
+                else self.__format(alpha_namer())
+        return self.__alpha_string
+
+    @property
+    def sort_key(self):
+        """See sort_key"""
+        if self.__sort_key is None:
+            self.__sort_key = string_sort_key(str(self))
+        return self.__sort_key
+
+    @property
+    def canonical(self):
+        """See canonical_parts"""
+        if self.__canonical is None:
+            return self, ()
+        return self.__canonical
+
     def with_parens(self, mv_to_string=None):
         return f'({self.__str__(mv_to_string)})'
 
     @property
     def semty(self):
-        return semantic_types.ArrowType(self.__dom.semty, self.__cod.semty)
+        return self.info.semty
 
     def __eq__(self, other, mvs_l=None, mvs_r=None):
         """Checks for alpha-equivalence (not unifiability)"""
+        if self is other and (self.__closed or mvs_l is None):
+            # in particular, equal closed categories are interned
+            # (but a shared open subterm must still record its
+            # metavariables in mvs_l and mvs_r)
+            return True
         if hash(self) != hash(other):
             # We have arranged the hash function so that equal values
             # have equal hashes.
@@ -432,6 +691,127 @@ class SlashCategory:
 
 
 
+###########################
+# TRAIL-BASED UNIFICATION #
+###########################
+
+USE_BINDINGS = True   # unify with Bindings rather than with pmaps
+
+
+class Bindings:
+    """A mutable substitution, the alternative to the pmaps built by
+       sub_unify: each metavariable (by id) is bound to a value at most
+       once, and every binding is recorded on a trail so that it can
+       be undone. A Bindings can be passed to subst wherever a pmap
+       could, and looks up the values of metavariables transitively."""
+
+    __slots__ = ('__values', '__trail')
+
+    def __init__(self):
+        self.__values = {}
+        self.__trail = []
+
+    def get(self, key, default=None):
+        value = self.__values.get(key)
+        if value is None:
+            return default
+        return value.subst(self)
+
+    def mark(self):
+        """A point on the trail to come back to with undo"""
+        return len(self.__trail)
+
+    def undo(self, mark):
+        """Forgets every binding made since the given mark"""
+        while len(self.__trail) > mark:
+            del self.__values[self.__trail.pop()]
+
+    def walk(self, x):
+        """Follows the bindings of a metavariable until reaching an
+           unbound metavariable or something else"""
+        while isinstance(x, Metavar):
+            value = self.__values.get(id(x))
+            if value is None:
+                break
+            x = value
+        return x
+
+    def occurs(self, mv, x):
+        x = self.walk(x)
+        if x is mv:
+            return True
+        elif isinstance(x, SlashCategory):
+            return not x.closed and \
+                (self.occurs(mv, x.cod) or self.occurs(mv, x.dom))
+        elif isinstance(x, BaseCategory):
+            return any(self.occurs(mv, v) for v in x.attrs.values())
+        return False
+
+    def bind(self, mv, value):
+        if self.occurs(mv, value):
+            return False
+        self.__values[id(mv)] = value
+        self.__trail.append(id(mv))
+        return True
+
+    def unify(self, x, y):
+        """Like x.sub_unify(y), but extending these bindings; returns
+           whether it succeeded, leaving the bindings unchanged if not."""
+        mark = self.mark()
+        if self.__unify(x, y):
+            return True
+        self.undo(mark)
+        return False
+
+    def __unify(self, x, y):
+        x = self.walk(x)
+        y = self.walk(y)
+        if x is y:
+            return True
+        elif isinstance(x, Metavar):
+            if isinstance(y, Metavar):
+                third = Metavar(y.hint)
+                return self.bind(x, third) and self.bind(y, third)
+            return self.bind(x, y)
+        elif isinstance(y, Metavar):
+            return self.bind(y, x)
+        elif isinstance(x, Attr):
+            return x == y
+        elif isinstance(x, BaseCategory):
+            if not (isinstance(y, BaseCategory) and x.cat == y.cat):
+                return False
+            if x.closed and y.closed:
+                return y.attr_mask & ~x.attr_mask == 0
+            attrs = x.attrs
+            for k, v in y.attrs.items():
+                if k not in attrs or not self.__unify(v, attrs[k]):
+                    return False
+            return True
+        elif isinstance(x, SingletonCategory):
+            return x == y
+        elif isinstance(x, SlashCategory):
+            if x.shape != y.shape and \
+               x.shape is not None and y.shape is not None:
+                return False
+            # the other domain must be smaller (contravariant) and
+            # this codomain smaller (covariant), as in sub_unify
+            return (isinstance(y, SlashCategory) and
+                    x.slash <= y.slash and
+                    self.__unify(x.cod, y.cod) and
+                    self.__unify(y.dom, x.dom))
+        return False
+
+
+def unify(x, y):
+    """Unifies x with (a subtype of) y, returning a substitution for
+       subst, or None on failure. With USE_BINDINGS this is a Bindings,
+       otherwise the pmap from x.sub_unify(y)."""
+    if not USE_BINDINGS:
+        return x.sub_unify(y)
+    bindings = Bindings()
+    return bindings if bindings.unify(x, y) else None
+
+
 ############################
 # USEFUL COMMON CATEGORIES #
 ############################
@@ -469,7 +849,10 @@ def explicit_string(cat):
     return cat.__str__(f)
 
 
-def alpha_normalized_string(cat):
+def alpha_namer():
+    """A fresh mv_to_string function for __str__, naming the distinct
+       metavariables with hint X as X, X1, X2, ... in order of
+       appearance."""
     counter_map = collections.defaultdict(dict)
 
     def f(mv):
@@ -480,7 +863,31 @@ def alpha_normalized_string(cat):
             return mv.hint
         else:
             return f'{mv.hint}{n}'
-    return cat.__str__(f)
+    return f
+
+
+def alpha_normalized_string(cat):
+    """The string for the category with its metavariables named by
+       alpha_namer, which is the same for alpha-equivalent categories
+       with the same hints. It is computed once per category object,
+       for sorting, printing, etc."""
+    return cat.alpha_string
+
+
+slashre = re.compile(r'[/|\\]')
+
+
+def string_sort_key(s):
+    """Orders category strings by number of slashes, then length,
+       then text"""
+    s_nondirected, num_slashes = re.subn(slashre, "|", s)
+    return (num_slashes, len(s), s_nondirected, s)
+
+
+def sort_key(cat):
+    """The string_sort_key of the category's string, computed once
+       per category object"""
+    return cat.sort_key
 
 
 def strip_attributes(c):
@@ -535,13 +942,113 @@ def test_alpha_str():
             assert (x == y) == \
                 (alpha_normalized_string(x) ==
                  alpha_normalized_string(y))
+            assert (x == y) == (hash(x) == hash(y))
+            assert alpha_normalized_string(x) == \
+                x.__str__(alpha_namer())
 
     for x in cats:
         xr = x.refresh()
         assert x == xr
 
+    # ...also with metavariables shared between the parts, as in X\X/X
+    mv3 = Metavar('A')
+    cats = [SlashCategory(SlashCategory(a, slash.LSLASH, b),
+                          slash.RSLASH, c)
+            for a in [mv1, mv2, mv3]
+            for b in [mv1, mv2, mv3]
+            for c in [mv1, mv2, mv3, NP]]
+    for x in cats:
+        for y in cats:
+            assert (x == y) == \
+                (alpha_normalized_string(x) ==
+                 alpha_normalized_string(y))
+            assert (x == y) == (canonical_form(x) == canonical_form(y))
+            assert (x == y) == (hash(x) == hash(y))
+        assert hash(x.refresh()) == hash(x)
+
+    # A subterm shared by both sides is not trivially equal to itself
+    # once its metavariables are paired with others: X/NP/X and
+    # X/NP/X1 differ even though both are built on the same X/NP.
+    mv4 = Metavar('A')
+    part = SlashCategory(mv1, slash.RSLASH, NP)
+    assert SlashCategory(part, slash.RSLASH, mv1) != \
+        SlashCategory(part, slash.RSLASH, mv4)
+    for x in [part, BaseCategory('S', semantic_types.t,
+                                     pyrsistent.m(num=mv1))]:
+        mvs_l, mvs_r = {}, {}
+        assert mv1.__eq__(mv4, mvs_l, mvs_r)
+        assert not x.__eq__(x, mvs_l, mvs_r)
+
+
+def test_interning():
+    assert SlashCategory(S, slash.LSLASH, NP) is VBI
+    assert BaseCategory("NP", semantic_types.ett) is NP
+    assert pickle.loads(pickle.dumps(MODAL)) is MODAL
+
+    mv = Metavar('X')
+    open_cat = SlashCategory(mv, slash.RSLASH, mv)
+    assert SlashCategory(mv, slash.RSLASH, mv) is not open_cat
+    assert SlashCategory(mv, slash.RSLASH, mv) == open_cat
+
+def test_sort_key():
+    assert sort_key(VBT) is sort_key(VBT)
+    assert sort_key(VBT) == string_sort_key(str(VBT))
+    assert sorted([VBT, NP, VBI], key=sort_key) == [NP, VBI, VBT]
+
+
+def test_info():
+    info = VBT.info
+    assert info.arity == 2
+    assert info.args == ((slash.RSLASH, NP), (slash.LSLASH, NP))
+    assert info.result is S
+    assert info.semty == VBT.semty
+    assert info.closed
+    assert VBT.info is info
+    assert VBI.info.shape != SlashCategory(S, slash.RSLASH, NP).info.shape
+
+    mv = Metavar('X')
+    info = SlashCategory(mv, slash.RSLASH, NP).info
+    assert info.result is mv and not info.closed and info.shape is None
+
+
+def test_attr_mask():
+    np_3sg = mk_NP(pyrsistent.m(per=Attr('3'), num=Attr('sg')))
+    np_sg = mk_NP(pyrsistent.m(num=Attr('sg')))
+    np_pl = mk_NP(pyrsistent.m(num=Attr('pl')))
+    assert np_3sg.sub_unify(np_sg) is not None
+    assert np_sg.sub_unify(np_3sg) is None
+    assert np_3sg.sub_unify(np_pl) is None
+    assert NP.sub_unify(np_sg) is None
+    assert np_sg.sub_unify(NP) is not None
+    assert unify(np_3sg, np_sg) is not None
+    assert unify(np_pl, np_3sg) is None
+    assert mk_NP(pyrsistent.m(num=Metavar('N'))).attr_mask is None
+
+
+def test_bindings():
+    mv = Metavar('X')
+    coord = SlashCategory(SlashCategory(mv, slash.LSLASH, mv),
+                          slash.RSLASH, mv)
+    bindings = Bindings()
+    mark = bindings.mark()
+    assert bindings.unify(VBI, mv)
+    assert coord.subst(bindings) == coord.subst(VBI.sub_unify(mv))
+    assert coord.subst(bindings) is \
+        SlashCategory(SlashCategory(VBI, slash.LSLASH, VBI), slash.RSLASH, VBI)
+    bindings.undo(mark)
+    assert coord.subst(bindings) == coord
+
+    # a failed unification leaves no bindings behind
+    assert not bindings.unify(SlashCategory(mv, slash.RSLASH, mv), VBT)
+    assert bindings.get(id(mv)) is None
+    assert unify(VBT, MODAL) is None
+    assert unify(VBT.cod, MODAL.dom) is not None
 
 
 if __name__ == '__main__':
     test_eq()
     test_alpha_str()
+    test_interning()
+    test_info()
+    test_attr_mask()
+    test_bindings()
@@ -3,6 +3,83 @@ import collections
 import slash
 
 
+WILDCARD = '*'     # the symbol for a metavariable
+SLASH = '|'        # the symbol for a slash category, of either direction
+
+
+def symbol(cat):
+    """The symbol for the outermost constructor of a category in a
+       DiscriminationTree. Attributes and slashes are left out, as
+       subtyping makes them awkward to match exactly; the categories
+       that come out of the tree still need to be unified."""
+    if isinstance(cat, category.Metavar):
+        return WILDCARD
+    elif isinstance(cat, category.SlashCategory):
+        return SLASH
+    elif isinstance(cat, category.SingletonCategory):
+        return ('"', cat.word)
+    return cat.cat
+
+
+class DiscriminationTree:
+    """A trie over the symbols of categories in preorder, for finding
+       the stored values whose categories might unify with a given one.
+       Metavariables match any subterm, both in the categories stored
+       and in the query. Values come back in the order they were
+       inserted."""
+
+    def __init__(self):
+        self.__root = ({}, [])    # (children by symbol, values)
+        self.__count = 0
+
+    def insert(self, cat, value):
+        node = self.__root
+        todo = [cat]
+        while todo:
+            term = todo.pop()
+            sym = symbol(term)
+            node = node[0].setdefault(sym, ({}, []))
+            if sym == SLASH:
+                todo += [term.dom, term.cod]
+        node[1].append((self.__count, value))
+        self.__count += 1
+
+    def unifiable(self, cat):
+        """The values whose categories might unify with cat"""
+        found = []
+        self.__retrieve(self.__root, [cat], found)
+        found.sort(key=lambda pair: pair[0])
+        return [value for _, value in found]
+
+    def __retrieve(self, node, todo, found):
+        if not todo:
+            found.extend(node[1])
+            return
+        term = todo[-1]
+        rest = todo[:-1]
+        children = node[0]
+        if isinstance(term, category.Metavar):
+            for child in self.__skip(node, 1):
+                self.__retrieve(child, rest, found)
+            return
+        if WILDCARD in children:
+            self.__retrieve(children[WILDCARD], rest, found)
+        sym = symbol(term)
+        if sym in children:
+            if sym == SLASH:
+                rest += [term.dom, term.cod]
+            self.__retrieve(children[sym], rest, found)
+
+    def __skip(self, node, n):
+        """The nodes reached from node by skipping n whole subterms"""
+        for sym, child in node[0].items():
+            remaining = n - 1 + (2 if sym == SLASH else 0)
+            if remaining == 0:
+                yield child
+            else:
+                yield from self.__skip(child, remaining)
+
+
 class CatSet:
     def __init__(self, cat_orig_rule_triples=[]):
         self.__data = list(cat_orig_rule_triples)   # copy just in case
@@ -15,6 +92,7 @@ class CatSet:
         self.__right = None
         self.__all = None
         self.__wo_rules = {}
+        self.__tree = None
 
     def __str__(self):
         return "{{" + ', '.join([category.alpha_normalized_string(c) for c in self.all]) + "}}"
@@ -25,6 +103,38 @@ class CatSet:
             self.__all = list(orig for _, orig, _ in self.__data)
         return [cat.refresh() for cat in self.__all]
 
+    def update(self, cat_orig_rule_triples):
+        """Adds more (cat, orig, rules) triples, e.g., the categories of
+           a level of inhabit.populate_inhabited as they are found. They
+           go straight into the discrimination tree (see unifiable);
+           the other indexes are rebuilt when next needed."""
+        triples = list(cat_orig_rule_triples)
+        if self.__tree is None:
+            self.__tree = DiscriminationTree()
+            for cat, orig, _ in self.__data:
+                self.__tree.insert(cat, orig)
+        for cat, orig, _ in triples:
+            self.__tree.insert(cat, orig)
+        self.__data += triples
+        self.__slash_triples += [(cat, orig, rule)
+                                 for cat, orig, rule in triples
+                                 if isinstance(cat, category.SlashCategory)]
+        self.__with_shape = None
+        self.__has_slash = None
+        self.__left = None
+        self.__right = None
+        self.__all = None
+        self.__wo_rules = {}
+
+    def unifiable(self, query):
+        """Like all, but only the categories that might unify with query
+           (see DiscriminationTree), in the same order."""
+        if self.__tree is None:
+            self.__tree = DiscriminationTree()
+            for cat, orig, _ in self.__data:
+                self.__tree.insert(cat, orig)
+        return [cat.refresh() for cat in self.__tree.unifiable(query)]
+
     @property
     def with_shape(self):
         if self.__with_shape is None:
@@ -90,3 +200,36 @@ class CatSet:
             self.__right = CatSet([(cat.dom, orig, rule)
                                    for cat, orig, rule in self.__slash_triples])
         return self.__right
+
+
+#####################
+# Simple unit tests #
+#####################
+
+
+def test_discrimination_tree():
+    mv = category.Metavar('X')
+    coord = category.SlashCategory(
+        category.SlashCategory(mv, slash.LSLASH, mv), slash.RSLASH, mv)
+    tree = DiscriminationTree()
+    for cat in [category.NP, category.S, category.VBI, category.VBT, mv,
+                coord, category.SingletonCategory('to')]:
+        tree.insert(cat, cat)
+    assert tree.unifiable(category.NP) == [category.NP, mv]
+    assert tree.unifiable(category.VBI) == [category.VBI, mv]
+    assert tree.unifiable(category.VBT) == [category.VBT, mv, coord]
+    assert len(tree.unifiable(category.Metavar('Y'))) == 7
+    # slashes are not indexed, so (S\NP)/NP is a candidate for Y\NP
+    assert tree.unifiable(
+        category.SlashCategory(category.Metavar('Y'), slash.LSLASH,
+                               category.NP)) == \
+        [category.VBI, category.VBT, mv, coord]
+
+    # A CatSet can grow, keeping its tree
+    cats = CatSet([(category.NP, category.NP, {'LEX'})])
+    assert cats.unifiable(mv) == [category.NP]
+    cats.update([(category.VBI, category.VBI, {'LEX'}),
+                 (coord, coord, {'LEX'})])
+    assert cats.unifiable(category.VBT) == [coord]
+    assert cats.all == [category.NP, category.VBI, coord.refresh()]
+    assert len(cats.has_slash[slash.LSLASH].all) == 1
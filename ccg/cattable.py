@@ -0,0 +1,203 @@
+"""
+A compact encoding of categories as small integers.
+
+A CategoryTable gives each distinct category an integer code, and keeps
+one row per code in parallel arrays: the kind of category, its base
+name or codomain, its slash, its domain and its attributes (all as
+codes too). Tools that handle hundreds of thousands of categories
+can then keep them as codes rather than as graphs of objects, and
+look up what they need (shape, closed, arity, semty, the string) by
+code; inhabit.populate_inhabited, for one, records the operands of
+its productions this way.
+
+Categories with metavariables have no row structure of their own
+(the metavariables may be shared between the parts); they are kept
+whole, one alpha-equivalence class per code.
+"""
+
+import array
+
+import category
+import pyrsistent
+import slash
+
+# Kinds of rows
+BASE = 0
+SLASH = 1
+SINGLETON = 2
+OPEN = 3
+
+NONE = -1     # the slash or domain of a row that has none
+
+
+class CategoryTable:
+    """The codes of the categories seen so far, and their rows"""
+
+    def __init__(self):
+        self.__kind = array.array('b')
+        self.__left = array.array('l')   # name, codomain, or open category
+        self.__slash = array.array('b')
+        self.__dom = array.array('l')
+        self.__attrs = array.array('l')
+        self.__shape = array.array('q')
+        self.__arity = array.array('h')
+        self.__semty = array.array('l')
+        # maps each row (as a tuple) to its code
+        self.__codes = {}
+        # the values the rows refer to, and their indexes
+        self.__names = []              # (name, semty) or (word, None)
+        self.__slashes = []
+        self.__attr_vectors = []
+        self.__open = []
+        self.__semtys = []
+        self.__indexes = {}
+
+    def __len__(self):
+        return len(self.__kind)
+
+    def __index(self, table, value):
+        key = (id(table), value)
+        if key not in self.__indexes:
+            self.__indexes[key] = len(table)
+            table.append(value)
+        return self.__indexes[key]
+
+    def __row(self, row, cat, arity):
+        code = self.__codes.get(row)
+        if code is None:
+            shape = cat.shape
+            code = len(self.__kind)
+            kind, left, sl, dom, attrs = row
+            self.__kind.append(kind)
+            self.__left.append(left)
+            self.__slash.append(sl)
+            self.__dom.append(dom)
+            self.__attrs.append(attrs)
+            self.__shape.append(0 if shape is None else shape)
+            self.__arity.append(arity)
+            self.__semty.append(self.__index(self.__semtys, cat.semty))
+            self.__codes[row] = code
+        return code
+
+    def encode(self, cat):
+        """The code for the category (adding it to the table if need be)"""
+        if not cat.closed:
+            # Open categories hash and compare up to alpha-equivalence
+            left = self.__index(self.__open, cat)
+            return self.__row((OPEN, left, NONE, NONE, NONE),
+                              cat, arity(cat))
+        if isinstance(cat, category.SlashCategory):
+            cod = self.encode(cat.cod)
+            dom = self.encode(cat.dom)
+            sl = self.__index(self.__slashes, cat.slash)
+            return self.__row((SLASH, cod, sl, dom, NONE),
+                              cat, self.__arity[cod] + 1)
+        if isinstance(cat, category.SingletonCategory):
+            left = self.__index(self.__names, (cat.word, None))
+            return self.__row((SINGLETON, left, NONE, NONE, NONE), cat, 0)
+        left = self.__index(self.__names, (cat.cat, cat.semty))
+        attrs = self.__index(self.__attr_vectors, cat.attrs)
+        return self.__row((BASE, left, NONE, NONE, attrs), cat, 0)
+
+    def decode(self, code):
+        """The category with the given code"""
+        kind = self.__kind[code]
+        left = self.__left[code]
+        if kind == SLASH:
+            return category.SlashCategory(self.decode(left),
+                                          self.__slashes[self.__slash[code]],
+                                          self.decode(self.__dom[code]))
+        elif kind == BASE:
+            name, semty = self.__names[left]
+            return category.BaseCategory(
+                name, semty, self.__attr_vectors[self.__attrs[code]])
+        elif kind == SINGLETON:
+            return category.SingletonCategory(self.__names[left][0])
+        return self.__open[left]
+
+    def kind(self, code):
+        return self.__kind[code]
+
+    def cod(self, code):
+        """The code of the codomain of a (closed) slash category"""
+        assert self.__kind[code] == SLASH
+        return self.__left[code]
+
+    def dom(self, code):
+        """The code of the domain of a (closed) slash category"""
+        assert self.__kind[code] == SLASH
+        return self.__dom[code]
+
+    def slash(self, code):
+        """The slash of a (closed) slash category, or None"""
+        sl = self.__slash[code]
+        return None if sl == NONE else self.__slashes[sl]
+
+    def shape(self, code):
+        if self.__kind[code] == OPEN:
+            return self.__open[self.__left[code]].shape
+        return self.__shape[code]
+
+    def closed(self, code):
+        return self.__kind[code] != OPEN
+
+    def arity(self, code):
+        """The number of arguments the category takes"""
+        return self.__arity[code]
+
+    def semty(self, code):
+        return self.__semtys[self.__semty[code]]
+
+    def string(self, code):
+        """The category as a string (as str would give)"""
+        kind = self.__kind[code]
+        if kind == SLASH:
+            dom = self.string(self.__dom[code])
+            if self.__kind[self.__dom[code]] == SLASH:
+                dom = f'({dom})'
+            return f'{self.string(self.__left[code])}' \
+                   f'{self.__slashes[self.__slash[code]]}{dom}'
+        return str(self.decode(code))
+
+
+def arity(cat):
+    """The number of arguments a category takes"""
+    n = 0
+    while isinstance(cat, category.SlashCategory):
+        cat = cat.cod
+        n += 1
+    return n
+
+
+#####################
+# Simple unit tests #
+#####################
+
+
+def test_table():
+    table = CategoryTable()
+    mv = category.Metavar('X')
+    coord = category.SlashCategory(
+        category.SlashCategory(mv, slash.LSLASH, mv), slash.RSLASH, mv)
+    np_sg = category.mk_NP(pyrsistent.m(num=category.Attr('sg')))
+    cats = [category.MODAL, category.VBT, np_sg,
+            category.SingletonCategory('to'), coord]
+    codes = [table.encode(cat) for cat in cats]
+    # S, NP, S\NP, (S\NP)/(S\NP), (S\NP)/NP, NP[sg], "to", X\X/X
+    assert len(table) == 8
+    assert codes == [table.encode(cat) for cat in cats]
+    assert table.encode(coord.refresh()) == codes[-1]
+    for cat, code in zip(cats, codes):
+        assert table.decode(code) == cat
+        assert table.string(code) == str(cat)
+        assert table.shape(code) == cat.shape
+        assert table.closed(code) == cat.closed
+        assert table.semty(code) == cat.semty
+        assert table.arity(code) == arity(cat)
+    assert table.decode(codes[0]) is category.MODAL
+    assert table.decode(table.cod(codes[1])) is category.VBI
+    assert table.slash(codes[1]) == slash.RSLASH
+
+
+if __name__ == '__main__':
+    test_table()
@@ -0,0 +1,90 @@
+"""
+Chart cells that index their items by category shape and slash,
+so that a rule need only look at the items it could combine with.
+"""
+
+import category
+
+
+class Cell(list):
+    """The list of items for one span of the chart.
+
+       Items are only ever appended to a cell, so the indexes are
+       brought up to date lazily, whenever they are consulted.
+    """
+
+    def __init__(self, items=[]):
+        super().__init__(items)
+        self.__indexed = 0
+        self.__by_slash = {}
+        # for each depth d, maps the shape of the d-th codomain of
+        #  each item's category to those items.
+        self.__by_shape = []
+        # for each depth d, all the items that have a d-th codomain.
+        self.__with_depth = []
+        # answers to previous queries
+        self.__functors = {}
+        self.__with_shape = {}
+        # maps each item signature to a Cell of the items with it
+        self.__by_signature = {}
+        self.__partitioned = 0
+
+    def __update(self):
+        if self.__indexed == len(self):
+            return
+        self.__functors = {}
+        self.__with_shape = {}
+        for item in self[self.__indexed:]:
+            cat = item.cat
+            if isinstance(cat, category.SlashCategory):
+                self.__by_slash.setdefault(cat.slash, []).append(item)
+            depth = 0
+            while True:
+                if depth == len(self.__by_shape):
+                    self.__by_shape.append({})
+                    self.__with_depth.append([])
+                self.__by_shape[depth].setdefault(cat.shape, []).append(item)
+                self.__with_depth[depth].append(item)
+                if not isinstance(cat, category.SlashCategory):
+                    break
+                cat = cat.cod
+                depth += 1
+        self.__indexed = len(self)
+
+    @property
+    def by_signature(self):
+        """Partitions the items by their signatures (see Item.signature)
+           into a dictionary of Cells"""
+        for item in self[self.__partitioned:]:
+            sig = item.signature
+            if sig not in self.__by_signature:
+                self.__by_signature[sig] = Cell()
+            self.__by_signature[sig].append(item)
+        self.__partitioned = len(self)
+        return self.__by_signature
+
+    def functors(self, slashes):
+        """The items whose categories are functions with one of the
+           given (outermost) slashes, which should be a frozenset."""
+        self.__update()
+        if slashes not in self.__functors:
+            self.__functors[slashes] = \
+                [item for sl in slashes
+                 for item in self.__by_slash.get(sl, [])]
+        return self.__functors[slashes]
+
+    def with_shape(self, shape, depth=0):
+        """The items whose categories have a depth-th codomain
+           (counting the category itself as the 0th) that might unify
+           with a category of the given shape."""
+        self.__update()
+        if depth >= len(self.__by_shape):
+            return []
+        if shape is None:
+            return self.__with_depth[depth]
+        key = (shape, depth)
+        if key not in self.__with_shape:
+            by_shape = self.__by_shape[depth]
+            self.__with_shape[key] = \
+                by_shape.get(shape, []) + by_shape.get(None, [])
+        return self.__with_shape[key]
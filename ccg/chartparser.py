@@ -7,16 +7,24 @@ Created on Tue May 30 14:13:01 2017
 @author: Chris Stone
 """
 
+import collections
+import heapq
+import itertools
+import multiprocessing
+import pickle
 import re
 
 from category import *
+from chartcell import Cell
 import formatting
-from item import Item
+import goalfilter
+from item import Item, PackedItem
 import pyrsistent
 import semantics
 import rules
 
 USE_SINGLETONS = False
+USE_INDEXES = True     # only try rules on items whose shapes can match
 
 # LEXICON CONSTRUCTION
 
@@ -103,84 +111,595 @@ LEXICON = {'fido': [pn('fido', pyrsistent.m(num='sg'))],
 ###########
 
 
-def mkChart(wds, lexicon=LEXICON):
+def lexical_cell(word, lexicon=LEXICON, packed=False, recognize=False):
+    """Creates the initial chart cell for one word/leaf, holding the
+       lexicon information for it (as PackedItems, if packed is true,
+       or just the distinct categories, if recognize is true)."""
+    # We clone the lexicon list because unary promotion rules can
+    # add new items to single-word lists, but we don't want to
+    # permanently change the static dictionary.
+    cell = Cell(
+        [Item(SingletonCategory(word), semantics.Const('_'), word)]
+        if USE_SINGLETONS else [])
+    for info in lexicon[word]:
+        if isinstance(info, Item):
+            cell.append(info)
+        else:
+            cat, sem = info
+            sem = sem if sem else semantics.Const(word)
+            cell.append(Item(cat, sem, word))
+    if packed:
+        items = cell
+        cell = Cell()
+        classes = {}
+        for item in items:
+            pack(cell, classes, item, item.why)
+    elif recognize:
+        items = cell
+        cell = Cell()
+        add = cell_adder(cell, recognize=True)
+        for item in items:
+            add(Item(item.cat, None, item.why), None)
+    return cell
+
+
+def mkChart(wds, lexicon=LEXICON, packed=False, recognize=False):
     """Creates an initial chart for the given list of words.
        It starts out near-empty, with just the
-       lexicon information for each word/leaf."""
-    chart = {}
-    for i in range(len(wds)):
-        # We clone the lexicon list because unary promotion rules can
-        # add new items to single-word lists, but we don't want to
-        # permanently change the static dictionary.
-        word = wds[i]
-        chart[(i, i)] = \
-            [Item(SingletonCategory(word), semantics.Const('_'), word)] \
-            if USE_SINGLETONS else []
-        for info in lexicon[wds[i]]:
-            if isinstance(info, Item):
-                chart[(i, i)].append(info)
-            else:
-                cat, sem = info
-                sem = sem if sem else semantics.Const(word)
-                chart[(i, i)].append(Item(cat, sem, word))
-    return chart
-
-
-def fillCell(chart, i, j, rules=rules.parsingRules):
-    """Update the chart to fill in cell (i,j), which covers
-       the i-th word to the j-th word, INCLUSIVE. It works by
-       applying all the binary rules to all possible ways to
-       partition the range into two nonempty sub-segments,
-       and then applies all the unary rules to the results."""
-    DEBUG = False
-    if DEBUG:
-        print(f"fillcell {i},{j}")
-    if (i, j) not in chart:
-        chart[(i, j)] = []
+       lexicon information for each word/leaf.
+       If packed is true, the chart holds PackedItems (see fillCell);
+       if recognize is true, items without semantics (see parse)."""
+    return {(i, i): lexical_cell(wds[i], lexicon, packed, recognize)
+            for i in range(len(wds))}
+
+
+def pack(cell, classes, item, why):
+    """Adds the given item to a cell of a packed chart, with derivation
+       why. If the cell already has a node with the same category,
+       semantics, and final rule (which is all that the rules look at),
+       the derivation is shared with that node instead.
+       classes maps the (category, rule, semantics) of each node in the
+       cell to the node."""
+    key = (item.cat, item.rule(), item.sem)
+    node = classes.get(key)
+    if node is not None:
+        node.add_derivation(why)
+        return
+    node = PackedItem(item.cat, item.sem, why)
+    classes[key] = node
+    cell.append(node)
+
+
+def candidate_pairs(cell1, cell2, binaryRules):
+    """Generates the (rule, item1, item2) combinations worth trying
+       for items from two adjacent cells. With USE_INDEXES, each pair
+       of item signatures is only given the rules whose preconditions
+       hold (see rules.DispatchTable), and a rule listed in
+       rules.PARTNERS only sees the functors with suitable slashes
+       paired with the items whose shapes can match their domains.
+       Otherwise every rule sees every pair."""
+    if not (USE_INDEXES and isinstance(cell1, Cell) and
+            isinstance(cell2, Cell)):
+        for item1 in cell1:
+            for item2 in cell2:
+                for binaryRule in binaryRules:
+                    yield binaryRule, item1, item2
+        return
+
+    table = rules.dispatch_table(binaryRules)
+    for sig1, part1 in cell1.by_signature.items():
+        for sig2, part2 in cell2.by_signature.items():
+            for binaryRule in table.rules_for(sig1, sig2):
+                if binaryRule not in rules.PARTNERS:
+                    for item1 in part1:
+                        for item2 in part2:
+                            yield binaryRule, item1, item2
+                    continue
+                functor_side, slashes, depth = rules.PARTNERS[binaryRule]
+                if functor_side == 0:
+                    for item1 in part1.functors(slashes):
+                        for item2 in part2.with_shape(item1.cat.dom.shape,
+                                                      depth):
+                            yield binaryRule, item1, item2
+                else:
+                    for item2 in part2.functors(slashes):
+                        for item1 in part1.with_shape(item2.cat.dom.shape,
+                                                      depth):
+                            yield binaryRule, item1, item2
+
+
+def cell_adder(cell, packed=False, goal_filter=None, recognize=False):
+    """Returns a function add(item, why) that puts an item newly derived
+       (by why, with backpointers to the actual inputs) into the cell:
+       as it is, or, if packed is true, via pack. If recognize is true,
+       the item is only added if the cell has no item yet with the same
+       category and final rule (which is all that the rules look at),
+       and why is ignored. With a goal_filter (see
+       goalfilter.GoalFilter), items that it does not admit are dropped
+       instead."""
+    if recognize:
+        seen = {(item.cat, item.rule()) for item in cell}
+
+        def add(item, why):
+            key = (item.cat, item.rule())
+            if key not in seen:
+                seen.add(key)
+                cell.append(item)
+    elif not packed:
+        add = lambda item, why: cell.append(item)
+    else:
+        classes = {(node.cat, node.rule(), node.sem): node for node in cell}
+        add = lambda item, why: pack(cell, classes, item, why)
+    if goal_filter is None:
+        return add
+    return lambda item, why: \
+        add(item, why) if goal_filter.admits(item) else None
+
+
+def apply_rules(chart, i, j, rules, add):
+    """Applies the binary rules to all the ways of splitting (i,j) into
+       two nonempty sub-segments, and then the unary rules to the items
+       in cell (i,j), passing each result to add (see cell_adder)."""
     # print(f'chart[({i},{j})] = {[str(i) for i in chart[(i,j)]]} (1)')
     for d in range(j-i):
         # print(f'combining ({i},{i+d}) with ({i+d+1},{j})')
         cell1 = chart[(i, i + d)]      # parse of the first d words of segment
         cell2 = chart[(i + d + 1, j)]  # parse of the remaining words
         # print(f'cell1 = {cell1} and cell2 = {cell2}')
-        for item1 in cell1:
-            for item2 in cell2:
-                # print(f'checking ({cat1},{sem1}) & ({cat2},{sem2})')
-                # Apply all the binary rules to the partial parses
-                for binaryRule in rules[1]:
-                    binaryRule(item1, item2, chart[(i, j)])
+        # Apply all the binary rules to the partial parses
+        for binaryRule, item1, item2 in \
+                candidate_pairs(cell1, cell2, rules[1]):
+            # print(f'checking ({cat1},{sem1}) & ({cat2},{sem2})')
+            results = []
+            binaryRule(item1, item2, results)
+            for result in results:
+                add(result, [result.rule(), item1, item2])
     # print(f'chart[({i},{j})] = {[str(i) for i in chart[(i,j)]]} (2)')
     # Iterate over a copy of the cell that we're adding to, so we don't
     # apply unary rules to unary-rule-results. [Is this ever a problem?]
     for item in chart[(i, j)][:]:
         for unaryRule in rules[0]:
             # print(f'considering {item} for unary rule {unaryRule}')
-            unaryRule(item, chart[(i, j)])
+            results = []
+            unaryRule(item, results)
+            for result in results:
+                add(result, [result.rule(), item])
     # print(f'chart[({i},{j})] = {[str(i) for i in chart[(i,j)]]} (3)')
 
 
+def fillCell(chart, i, j, rules=rules.parsingRules, packed=False,
+             beam=None, goal_filter=None, recognize=False,
+             subsumption=None):
+    """Update the chart to fill in cell (i,j), which covers
+       the i-th word to the j-th word, INCLUSIVE. It works by
+       applying all the binary rules to all possible ways to
+       partition the range into two nonempty sub-segments,
+       and then applies all the unary rules to the results.
+       If packed is true, the cell gets one PackedItem per equivalence
+       class of derivations, and the rules are applied to these nodes
+       rather than to every derivation.
+       If a subsumption (see subsumption.Subsumption) is given, items
+       subsumed by more general ones are then dropped.
+       If a beam (see scoring.Beam) is given, the cell is then pruned to
+       the items that fit in it, before it is used for larger spans.
+       If a goal_filter is given, only the new items it admits are kept
+       (see cell_adder), and if recognize is true only the distinct ones
+       (which, having no semantics, are never pruned as subsumed)."""
+    DEBUG = False
+    if DEBUG:
+        print(f"fillcell {i},{j}")
+    if (i, j) not in chart:
+        chart[(i, j)] = Cell()
+    apply_rules(chart, i, j, rules,
+                cell_adder(chart[(i, j)], packed, goal_filter, recognize))
+    if subsumption is not None and not recognize:
+        chart[(i, j)] = Cell(subsumption.prune(chart[(i, j)]))
+    if beam is not None:
+        chart[(i, j)] = Cell(beam.prune(chart[(i, j)]))
+
+
+def chart_positions(chart, spans):
+    """Maps the id of each item in the given cells of the chart to its
+       (i, j, n) position, i.e., that it is item n of cell (i,j)"""
+    return {id(item): (i, j, n)
+            for (i, j) in spans
+            for n, item in enumerate(chart[(i, j)])}
+
+
+def fill_stubs(chart, positions, span, rules=rules.parsingRules,
+               packed=False, beam=None, goal_filter=None, recognize=False,
+               subsumption=None):
+    """Fills the given cell of (a worker's copy of) the chart, and
+       returns it in a compact picklable form: a list of (cat, sem, whys)
+       stubs, one per item, where whys lists the item's derivations with
+       each input item replaced by its (i, j, n) position (see
+       chart_positions) and, if the rule instantiated it (see
+       rules.conclude), the category of the instance, or else None;
+       the indexes of the stubs that survive pruning (see fillCell); and
+       the number of items subsumed. When recognizing, the whys are
+       just the items' own (the rule name)."""
+    i, j = span
+    cell = chart[span] = Cell()
+    add = cell_adder(cell, packed, goal_filter, recognize)
+    inputs = {}
+
+    def record(item, why):
+        inputs[id(item)] = why
+        add(item, why)
+
+    apply_rules(chart, i, j, rules, record)
+    own = chart_positions(chart, [span])
+
+    def locate(x, instance):
+        return (own.get(id(x)) or positions[id(x)]) + \
+            (None if instance is x or x.cat.closed else instance.cat,)
+
+    stubs = []
+    for item in cell:
+        # each derivation, with the instances of its inputs
+        if packed:
+            whys = [(why, why[1:]) for why in item.derivations]
+        elif recognize:
+            whys = [(item.why, [])]
+        else:
+            whys = [(inputs[id(item)], item.why[1:])]
+        stubs.append((item.cat, item.sem,
+                      [[why[0]] + [locate(x, instance) for x, instance
+                                   in zip(why[1:], instances)]
+                       for why, instances in whys]))
+    survivors = cell
+    if subsumption is not None and not recognize:
+        survivors = subsumption.prune(survivors)
+    subsumed = len(cell) - len(survivors)
+    if beam is not None:
+        survivors = beam.prune(survivors)
+    survivors = {id(item) for item in survivors}
+    kept = [n for n, item in enumerate(cell) if id(item) in survivors]
+    return stubs, kept, subsumed
+
+
+def unstub(chart, span, stubs, kept, packed=False):
+    """Rebuilds cell span of the chart from the result of fill_stubs"""
+    items = []
+
+    def resolve(i, j, n, cat):
+        item = items[n] if (i, j) == span else chart[(i, j)][n]
+        if cat is None:
+            return item
+        # instantiate it again, as the rule did
+        return item.subst(item.cat.sub_unify(cat))
+
+    for cat, sem, whys in stubs:
+        whys = [[why[0]] + [resolve(*position) for position in why[1:]]
+                for why in whys]
+        if packed:
+            item = PackedItem(cat, sem, whys[0])
+            for why in whys[1:]:
+                item.add_derivation(why)
+        else:
+            item = Item(cat, sem, whys[0])
+        items.append(item)
+    chart[span] = Cell([items[n] for n in kept])
+
+
+def diagonal_worker(conn, chart, rules, packed, beam, goal_filter,
+                    recognize, subsumption):
+    """The loop of a worker process of fill_diagonals. Each request
+       is a pickled list of the cells finished since the last one, as
+       (span, stubs, kept) triples, followed by the spans that this
+       worker should fill next; the reply is the result of fill_stubs
+       for each of them. An empty request ends the loop."""
+    positions = chart_positions(chart, chart.keys())
+    while True:
+        message = conn.recv_bytes()
+        if not message:
+            return
+        finished = pickle.loads(message)
+        spans = conn.recv()
+        for span, stubs, kept in finished:
+            unstub(chart, span, stubs, kept, packed)
+        positions.update(chart_positions(
+            chart, [span for span, _, _ in finished]))
+        conn.send([fill_stubs(chart, positions, span, rules, packed, beam,
+                              goal_filter, recognize, subsumption)
+                   for span in spans])
+
+
+def fill_diagonals(chart, nwds, rules=rules.parsingRules, packed=False,
+                   beam=None, processes=2, goal_filter=None,
+                   recognize=False, subsumption=None):
+    """Fills the cells of the chart that span more than one word, one
+       span length (diagonal) at a time. The cells of a diagonal only
+       depend on shorter spans, so they are shared out among worker
+       processes, forked with a copy of the chart so far. Each diagonal
+       is then sent back, and on to every worker, in the compact form
+       of fill_stubs, so that each rebuilt item has the same derivation
+       as in a serial parse. The items the workers find subsumed are
+       added to the count of the given subsumption."""
+    context = multiprocessing.get_context('fork')
+    workers = []
+    try:
+        for _ in range(processes):
+            conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=diagonal_worker,
+                args=(child_conn, chart, rules, packed, beam, goal_filter,
+                      recognize, subsumption),
+                daemon=True)
+            process.start()
+            workers.append((process, conn))
+        finished = []
+        for tot in range(1, nwds):
+            spans = [(i, i + tot) for i in range(nwds - tot)]
+            shares = [spans[n::processes] for n in range(processes)]
+            # pickle the finished cells just once for all the workers
+            message = pickle.dumps(finished)
+            for (_, conn), share in zip(workers, shares):
+                conn.send_bytes(message)
+                conn.send(share)
+            finished = []
+            for (_, conn), share in zip(workers, shares):
+                for span, (stubs, kept, subsumed) in \
+                        zip(share, conn.recv()):
+                    finished.append((span, stubs, kept))
+                    if subsumption is not None:
+                        subsumption.subsumed += subsumed
+            for span, stubs, kept in finished:
+                unstub(chart, span, stubs, kept, packed)
+    finally:
+        for process, conn in workers:
+            conn.send_bytes(b'')
+            process.join()
+
+
 def words(s: str):
     """Strip ALL punctuation and just returns the (lowercased) words
        as a list"""
     return re.sub(r'[^A-za-z]', ' ', s).lower().split()
 
 
-def parse(wds, lexicon=LEXICON):
-    """parse the given string and return all complete parses"""
+def parse(wds, lexicon=LEXICON, packed=False, beam=None, processes=1,
+          goal_category=None, recognize=False, subsumption=None):
+    """parse the given string and return all complete parses.
+       If packed is true, the result is instead the root of a packed
+       parse forest: one PackedItem per distinct complete parse.
+       If a beam (see scoring.Beam) is given, every cell is pruned to
+       fit it, so only the parses built from surviving items remain.
+       If a subsumption (see subsumption.Subsumption) is given, the items
+       subsumed by more general ones are dropped from every cell first,
+       and its .subsumed goes up by the number dropped.
+       With more than one process, the cells of each span length are
+       filled in parallel (see fill_diagonals).
+       If a goal_category is given, only the parses matching it are
+       returned, and items that cannot take part in one are dropped as
+       soon as they are made (see goalfilter.GoalFilter).
+       If recognize is true, only the categories are worked out: each
+       cell holds one item (with no semantics, and just the rule name as
+       its why) per distinct category and final rule, and the rules are
+       only applied to these, so that the categories of each span (see
+       span_categories) are those of a full parse, for much less work.
+       There are no derivations to rank, so the beam is ignored, and
+       no semantics to compare, so the subsumption is too."""
     nwds = len(wds)
-    chart = mkChart(wds, lexicon)
+    chart = mkChart(wds, lexicon, packed, recognize)
+    if recognize:
+        beam = None
+    goal_filter = None
+    if goal_category is not None:
+        goal_filter = goalfilter.GoalFilter(
+            goal_category,
+            [item.cat for cell in chart.values() for item in cell],
+            rules.parsingRules[0])
+        for span, cell in chart.items():
+            chart[span] = Cell(filter(goal_filter.admits, cell))
     # print(f'starting chart = {chart}')
-    for tot in range(0, nwds):
+    for tot in range(0, 1 if processes > 1 else nwds):
         for i in range(nwds-tot):
             j = i+tot
-            fillCell(chart, i, j)
+            fillCell(chart, i, j, packed=packed, beam=beam,
+                     goal_filter=goal_filter, recognize=recognize,
+                     subsumption=subsumption)
+    if processes > 1:
+        fill_diagonals(chart, nwds, packed=packed, beam=beam,
+                       processes=processes, goal_filter=goal_filter,
+                       recognize=recognize, subsumption=subsumption)
     # print(chart)
-    return chart[(0, nwds-1)], chart
+    items = chart[(0, nwds-1)]
+    if goal_category is not None:
+        items = [item for item in items
+                 if item.cat.sub_unify(goal_category) is not None]
+    return items, chart
+
+
+def count_parses(wds, lexicon=LEXICON, processes=1, goal_category=None):
+    """The number of complete parses of the given words (as parse would
+       return them), without building them: a Counter mapping each
+       reading, i.e., each distinct (category, semantics) pair, to its
+       number of derivations. These are worked out from the packed
+       chart, by summing over the derivations of each node (each split
+       point and rule) the products of the counts of their inputs
+       (see PackedItem.count)."""
+    nodes, _ = parse(wds, lexicon, packed=True, processes=processes,
+                     goal_category=goal_category)
+    counts = collections.Counter()
+    for node in nodes:
+        counts[(node.cat, node.sem)] += node.count
+    return counts
+
+
+def span_categories(chart):
+    """Maps each span of the chart to the set of categories derived
+       for it"""
+    return {span: {item.cat for item in cell}
+            for span, cell in chart.items()}
 
 
 def nwds_of_chart(chart):
-    # chart has (nwds+1) * (nwds+2) / 2 entries; invert to find nwds
-    return math.round((sqrt(1 + 8*len(chart)) - 3) / 2)
+    # cell (i, j) covers words i..j, so the last word is the largest j
+    return max(j for _, j in chart) + 1
+
+
+class Derivations:
+    """Lazily enumerates the complete derivations of one chart item
+       (typically a PackedItem) as Items, cheapest first.
+       The cost of a derivation is the sum of score(node, why) over
+       its steps; ties are broken in the order the parser found the
+       derivations. Derivations are built only when asked for, and are
+       memoized in .found so that every item using this one as an input
+       shares them (following Huang and Chiang 2005, Algorithm 3)."""
+
+    def __init__(self, node, streams, score):
+        self.node = node
+        self.found = []           # (cost, item) pairs, in order
+        self.__streams = streams  # maps id(node) to its Derivations
+        self.__score = score
+        self.__whys = node.derivations \
+            if isinstance(node, PackedItem) else [node.why]
+        self.__candidates = None
+        self.__seen = set()
+        self.__counter = itertools.count()
+
+    def get(self, k):
+        """Returns the k-th cheapest (cost, item) derivation, counting
+           from 0, or None if there are not that many."""
+        if self.__candidates is None:
+            self.__candidates = []
+            for n, why in enumerate(self.__whys):
+                ranks = (0,) * (len(why) - 1) \
+                    if isinstance(why, list) else ()
+                self.__push(n, ranks)
+        while len(self.found) <= k and self.__candidates:
+            cost, _, n, ranks = heapq.heappop(self.__candidates)
+            self.found.append((cost, self.__build(n, ranks)))
+            # The next-best derivations by the same rule and inputs
+            for i in range(len(ranks)):
+                self.__push(n, ranks[:i] + (ranks[i] + 1,) + ranks[i+1:])
+        return self.found[k] if k < len(self.found) else None
+
+    def __input(self, child):
+        return derivations_of(child, self.__streams, self.__score)
+
+    def __push(self, n, ranks):
+        if (n, ranks) in self.__seen:
+            return
+        self.__seen.add((n, ranks))
+        why = self.__whys[n]
+        cost = self.__score(self.node, why) if self.__score else 0
+        for child, rank in zip(why[1:], ranks):
+            best = self.__input(child).get(rank)
+            if best is None:
+                return
+            cost += best[0]
+        heapq.heappush(self.__candidates,
+                       (cost, next(self.__counter), n, ranks))
+
+    def __build(self, n, ranks):
+        if not isinstance(self.node, PackedItem):
+            # A plain Item is its own (only) derivation
+            return self.node
+        why = self.__whys[n]
+        if not isinstance(why, list):
+            return Item(self.node.cat, self.node.sem, why)
+        children = [self.__input(child).found[rank][1]
+                    for child, rank in zip(why[1:], ranks)]
+        return Item(self.node.cat, self.node.sem, [why[0]] + children)
+
+
+def derivations_of(node, streams, score=None):
+    """The Derivations object for the given item, shared through
+       streams (a dictionary from item ids)"""
+    key = id(node)
+    if key not in streams:
+        streams[key] = Derivations(node, streams, score)
+    return streams[key]
+
+
+def iter_stream(stream):
+    """Yields the derivations of a Derivations object in order"""
+    for rank in itertools.count():
+        found = stream.get(rank)
+        if found is None:
+            return
+        yield found[1]
+
+
+def iter_derivations(chart, goal=None, k=None, score=None):
+    """Yields the complete derivations in the chart (packed or not) one
+       at a time, as Items, optionally only those whose category
+       matches the goal, and at most k of them.
+       Without a score function, all the derivations of the first item
+       of the final cell come first, then those of the next one, and so
+       on; otherwise score(node, why) gives the cost of the last
+       step of a derivation of node, and the cheapest come first.
+       Only the derivations actually read are built."""
+    nwds = nwds_of_chart(chart)
+    roots = [item for item in chart[(0, nwds - 1)]
+             if goal is None or item.cat.sub_unify(goal) is not None]
+    streams = {}
+    if score is None:
+        # Every cost is 0, so there is nothing to merge
+        derivations = (item for root in roots
+                       for item in iter_stream(
+                           derivations_of(root, streams)))
+        yield from itertools.islice(derivations, k)
+        return
+    heap = []
+    counter = itertools.count()
+
+    def push(stream, rank):
+        best = stream.get(rank)
+        if best is not None:
+            heapq.heappush(heap, (best[0], next(counter), stream, rank))
+
+    for root in roots:
+        push(derivations_of(root, streams, score), 0)
+    yielded = 0
+    while heap and (k is None or yielded < k):
+        _, _, stream, rank = heapq.heappop(heap)
+        yield stream.found[rank][1]
+        yielded += 1
+        push(stream, rank + 1)
+
+
+class ChartSession:
+    """Parses a sentence incrementally, as its words arrive.
+       After each push(word), the chart holds every analysis of every
+       span of the words so far, exactly as parse would build it for
+       them (with the same packed and beam options)."""
+
+    def __init__(self, lexicon=LEXICON, packed=False, beam=None):
+        self.lexicon = lexicon
+        self.packed = packed
+        self.beam = beam
+        self.words = []
+        self.chart = {}
+
+    def push(self, word):
+        """Adds the next word, filling only the new cells (i,n) that end
+           with it; returns the analyses of all the words so far."""
+        n = len(self.words)
+        # Build the lexical cell before recording the word, so that an
+        # unknown word (KeyError) leaves the session as it was.
+        self.chart[(n, n)] = lexical_cell(word, self.lexicon, self.packed)
+        self.words.append(word)
+        # Cell (i,n) needs (k+1,n) for every k >= i
+        for i in range(n, -1, -1):
+            fillCell(self.chart, i, n, packed=self.packed, beam=self.beam)
+        return self.analyses()
+
+    def analyses(self, i=0, j=None):
+        """The items for words i to j inclusive (by default, from the
+           first word to the last one so far)"""
+        if j is None:
+            j = len(self.words) - 1
+        return self.chart.get((i, j), [])
+
+    def derivations(self, goal=None, k=None, score=None):
+        """Yields the derivations of all the words so far; see
+           iter_derivations"""
+        if not self.words:
+            return iter([])
+        return iter_derivations(self.chart, goal, k, score)
 
 
 def diagnose(wds, chart):
@@ -230,7 +749,9 @@ def diagnose(wds, chart):
 
 def p(label, sentence, lexicon=LEXICON,
       goal_category=None, expected_count=None):
-    """parse the given string, and pretty-print all complete parses"""
+    """parse the given string, and pretty-print all complete parses.
+       Printing them builds every parse anyway, so the count is just
+       that of the one plain parse (see count_parses to only count)."""
     print("\n", label,
           "*" if expected_count == 0 else "",
           sentence,
@@ -238,17 +759,15 @@ def p(label, sentence, lexicon=LEXICON,
           # expected_count or "",
           "\n")
     wds = words(sentence)
-    items, chart = parse(wds, lexicon)
-    if goal_category is not None:
-        items = [item for item in items
-                 if item.cat.sub_unify(goal_category) is not None]
+    items, chart = parse(wds, lexicon, goal_category=goal_category)
     if expected_count is not None and (expected_count != len(items)):
         print('\nWRONG PARSE COUNT',
               f'for GOAL {goal_category}' if goal_category is not None else "")
         print(f'Expected {expected_count}, found {len(items)}')
         if len(items) == 0:
             dump(sentence, lexicon)
-            diagnose(wds, chart)
+            # diagnose from everything, not just what the goal admits
+            diagnose(wds, parse(wds, lexicon)[1])
         elif len(items) > expected_count:
             for item in items[:expected_count+4]:
                 item.display()
@@ -0,0 +1,64 @@
+"""
+The category-level combinatory rules (application and composition),
+shared by the chart parser (rules.py), inhabit.py and tocfg.py.
+
+Combining two closed categories always gives the same answer, so those
+results are kept in a bounded LRU cache, across cells and sentences.
+"""
+
+import functools
+
+import category
+
+CACHE_SIZE = 100000   # closed category combinations to remember
+
+
+def replace_cod(cat, n, cod):
+    """The category with its n-th codomain replaced by cod
+       (so that replace_cod(cat, 0, cod) is just cod)"""
+    if n == 0:
+        return cod
+    return category.SlashCategory(replace_cod(cat.cod, n - 1, cod),
+                                  cat.slash, cat.dom)
+
+
+def uncached_compose(primary, secondary, n=0):
+    """See compose"""
+    arg = secondary
+    for _ in range(n):
+        arg = arg.cod
+    sub = category.unify(arg, primary.dom)
+    if sub is None:
+        return None
+    return replace_cod(secondary, n, primary.cod), sub
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def closed_compose(primary, secondary, n):
+    answer = uncached_compose(primary, secondary, n)
+    return None if answer is None else answer[0]
+
+
+def compose(primary, secondary, n=0):
+    """Combines a functor X|Y (the primary) with a category whose n-th
+       codomain unifies with Y (the secondary): n=0 is application,
+       n=1 composition, n=2 second-order composition, and so on.
+       Slash directions and modes are up to the caller.
+       Returns None if they do not combine, or else (result, sub) where
+       result still needs to be substituted with sub (as do the inputs,
+       to see how they were instantiated). For closed categories sub is
+       None, as there is nothing to substitute, and the result comes
+       from the cache."""
+    if primary.closed and secondary.closed:
+        result = closed_compose(primary, secondary, n)
+        return None if result is None else (result, None)
+    return uncached_compose(primary, secondary, n)
+
+
+def cache_info():
+    """Hit and miss counts (etc.) for the cache of closed combinations"""
+    return closed_compose.cache_info()
+
+
+def cache_clear():
+    closed_compose.cache_clear()
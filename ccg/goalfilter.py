@@ -0,0 +1,86 @@
+"""
+Top-down filtering of chart items when the goal category is known.
+
+Every rule in rules.py passes the target (the innermost codomain) of
+its primary functor on to its result, so an item can only take part
+in a derivation of the goal if its target is the goal's target, or
+the target of some argument that a category in the derivation takes,
+and the latter all come (up to substitution) from the lexicon entries
+of the sentence or from what the unary rules make of their parts.
+"""
+
+import category
+from item import Item
+import semantics
+
+
+def target(cat):
+    """The innermost codomain of a category"""
+    return cat.info.result
+
+
+def target_key(cat):
+    """What two targets must share to unify: the name of a base
+       category (ignoring its attributes), the word of a singleton
+       category, or None for a metavariable, which matches anything."""
+    cat = target(cat)
+    if isinstance(cat, category.BaseCategory):
+        return cat.cat
+    elif isinstance(cat, category.Metavar):
+        return None
+    return str(cat)
+
+
+def subterms(cat):
+    """All the subterms of a category, including itself"""
+    yield cat
+    if isinstance(cat, category.SlashCategory):
+        yield from subterms(cat.cod)
+        yield from subterms(cat.dom)
+
+
+class GoalFilter:
+    """Decides which items might contribute to a parse of the goal
+       category, given the categories of the lexicon entries of the
+       sentence and the unary rules. It never rejects an item that
+       could; if in doubt (e.g., an argument category whose target is
+       a metavariable) it admits everything."""
+
+    def __init__(self, goal, categories, unary_rules=()):
+        self.targets = {target_key(goal)}
+        self.admits_all = None in self.targets
+        categories = list(categories)
+        # Probe the unary rules with every part of the lexical categories
+        for cat in list(categories):
+            for part in subterms(cat):
+                for unaryRule in unary_rules:
+                    results = []
+                    unaryRule(Item(part, semantics.Const('_'), '_'),
+                              results)
+                    categories.extend(result.cat for result in results)
+        for cat in categories:
+            self.__add_arguments(cat)
+
+    def __add_arguments(self, cat):
+        """Records the targets of the arguments that cat (or any of its
+           arguments, etc.) takes"""
+        own = target(cat)
+        while isinstance(cat, category.SlashCategory):
+            arg = cat.dom
+            if target(arg) is not own:
+                # An argument sharing the functor's own target
+                # metavariable (as in X\X/X or T/(T\X)) passes its target
+                # on to the result, and so adds nothing new.
+                key = target_key(arg)
+                self.targets.add(key)
+                if key is None:
+                    self.admits_all = True
+            self.__add_arguments(arg)
+            cat = cat.cod
+
+    def admits(self, item):
+        """Might the item take part in a parse of the goal?"""
+        if self.admits_all:
+            return True
+        key = target_key(item.cat)
+        return key is None or key in self.targets
@@ -1,6 +1,8 @@
 import catparser
 import category
 import catset
+import cattable
+import combinators
 import ccgbank
 import collections
 import functools
@@ -10,7 +12,6 @@ import os
 import pickle
 import pyrsistent
 import random
-import re
 import semantic_types
 import slash
 import sys
@@ -37,14 +38,6 @@ USE_CATEGORIES_MOD = True
 MAX_CATEGORIES_MOD_LINES = 100
 
 
-slashre = re.compile(r'[/|\\]')
-
-
-def sort_key(s):
-    s_nondirected, num_slashes = re.subn(slashre, "|", s)
-    return (num_slashes, len(s), s_nondirected, s)
-
-
 def pp_info(cats):
     strs = [category.alpha_normalized_string(cat) for cat in cats]
     strs.sort(key=lambda s: (len(s), s))
@@ -59,16 +52,41 @@ def make_hierarchy(cat_to_rules):
 # mapping from level number n to the set of
 #    categories inhabited by (1 or more) n-word phrase
 inhabited = {}
+# mapping from level number n to a mapping from each category in
+#    inhabited[n] to the (operands, rule) pairs that produce it, with
+#    the operands as codes in TABLE
 productions = {}
+TABLE = cattable.CategoryTable()
 hierarchies = {}
 lexicon_hash = -1
 
 
+def codes(cats):
+    """The tuple of the TABLE codes for the given categories"""
+    return tuple(TABLE.encode(cat) for cat in cats)
+
+
+def with_categories(productions_n):
+    """productions_n with the operands as categories rather than
+       codes, e.g., for pickling (see with_codes)"""
+    return {cat: {(tuple(TABLE.decode(code) for code in whence), rule)
+                  for whence, rule in sources}
+            for cat, sources in productions_n.items()}
+
+
+def with_codes(productions_n):
+    """The inverse of with_categories"""
+    return collections.defaultdict(
+        set, {cat: {(codes(whence), rule) for whence, rule in sources}
+              for cat, sources in productions_n.items()})
+
+
 def reset(filename):
-    global inhabited, productions, lexicon_hash
+    global inhabited, productions, lexicon_hash, TABLE
 
     inhabited1 = collections.defaultdict(set)
     productions1 = collections.defaultdict(set)
+    TABLE = cattable.CategoryTable()
     if USE_CATEGORIES_MOD:
         with open('categories.mod.out', 'r') as f:
             linecount = 0
@@ -115,7 +133,7 @@ def reset(filename):
             type_raised += typeraise(cat, [])
         for cat, rule, whence in type_raised:
             inhabited1[cat].add(rule)
-            productions1[cat].add((tuple(whence), rule))
+            productions1[cat].add((codes(whence), rule))
 
     inhabited = {1: inhabited1}
     productions = {1: productions1}
@@ -141,15 +159,27 @@ def populate_inhabited(filename, max_n):
             reset(filename)
             inhabited_n = inhabited[1]
             productions_n = productions[1]
+            hierarchy = make_hierarchy(inhabited_n)
         else:
             pickle_file = f'pickles/inhabited.{lexicon_hash}.{n}.out'
             if USE_PICKLES and os.path.isfile(pickle_file):
                 with open(pickle_file, 'rb') as f:
                     print("...recovering from pickle file...")
                     (inhabited_n, productions_n) = pickle.load(f)
+                    productions_n = with_codes(productions_n)
+                hierarchy = make_hierarchy(inhabited_n)
             else:
                 inhabited_n = collections.defaultdict(set)
                 productions_n = collections.defaultdict(set)
+                # grows (with its index) as the categories are found
+                hierarchy = catset.CatSet()
+
+                def record(cat, rule, whence):
+                    if cat not in inhabited_n:
+                        hierarchy.update([(cat, cat, inhabited_n[cat])])
+                    inhabited_n[cat].add(rule)
+                    productions_n[cat].add((codes(whence), rule))
+
                 for k in range(1, n):
                     cats_left = hierarchies[k]
                     cats_right = hierarchies[n-k]
@@ -157,11 +187,9 @@ def populate_inhabited(filename, max_n):
                     def run_rule(rule_fn):
                             #print(f"run rule {rule_fn.__name__} for {k} and {n-k}")
                         nonlocal cats_left, cats_right
-                        nonlocal inhabited_n, productions_n
                         for cat, rule, whence in rule_fn(cats_left, cats_right):
                             #print(n, cat, rule, [str(x) for x in whence])
-                            inhabited_n[cat].add(rule)
-                            productions_n[cat].add((tuple(whence), rule))
+                            record(cat, rule, whence)
 
                     run_rule(forward_applies)
                     run_rule(backward_applies)
@@ -177,12 +205,12 @@ def populate_inhabited(filename, max_n):
                     #    continue
                     type_raised += typeraise(cat, [])
                 for cat, rule, whence in type_raised:
-                    inhabited_n[cat].add(rule)
-                    productions_n[cat].add((tuple(whence), rule))
+                    record(cat, rule, whence)
 
                 os.makedirs('pickles', exist_ok=True)
                 with open(pickle_file, 'wb') as f:
-                    pickle.dump((inhabited_n, productions_n), f)
+                    pickle.dump((inhabited_n, with_categories(productions_n)),
+                                f)
 
         inhabited[n] = inhabited_n
         productions[n] = productions_n
@@ -195,13 +223,13 @@ def populate_inhabited(filename, max_n):
             new_categories = list(these_categories - categories_seen)
             #new_categories = list(these_categories)
 
-            new_categories.sort(key=lambda c: sort_key(str(c)))
+            new_categories.sort(key=category.sort_key)
 
             print(" new categories include: ")
             for cat in new_categories[:25]:
                 for operands, rule in productions_n[cat]:
                     print(
-                        f"    {cat}    {'  '.join([category.alpha_normalized_string(c) for c in operands])}   {rule}")
+                        f"    {cat}    {'  '.join([category.alpha_normalized_string(TABLE.decode(c)) for c in operands])}   {rule}")
 
             missing_categories = list(categories_seen - these_categories)
             if ALSO_SHOW_WHATS_MISSING and missing_categories:
@@ -212,7 +240,7 @@ def populate_inhabited(filename, max_n):
 
         #print("these categories", pp_info(inhabited_n))
 
-        hierarchies[n] = make_hierarchy(inhabited_n)
+        hierarchies[n] = hierarchy
 
         production_graph = build_graph(productions)
         visited = bfs(production_graph)
@@ -221,18 +249,18 @@ def populate_inhabited(filename, max_n):
         for cat in visited:
             #print(f"rules for category {cat}")
             for whence, rule in set.union(*[productions[n][cat] for n in range(1, max_n+1)]):
-                whence_s = [
-                    category.alpha_normalized_string(c) for c in whence]
+                whence_s = [category.alpha_normalized_string(
+                    TABLE.decode(c)) for c in whence]
                 f.write(f"{cat} -> {' '.join(whence_s)}  {rule}\n")
 
     with open('rules.noncircular.out', 'w') as f:
         for cat in visited:
             #print(f"rules for category {cat}")
             for whence, rule in set.union(*[productions[n][cat] for n in range(1, max_n+1)]):
-                if cat in whence:
+                if TABLE.encode(cat) in whence:
                     continue
-                whence_s = [
-                    category.alpha_normalized_string(c) for c in whence]
+                whence_s = [category.alpha_normalized_string(
+                    TABLE.decode(c)) for c in whence]
                 f.write(f"{cat} -> {' '.join(whence_s)}  {rule}\n")
 
     return productions
@@ -247,17 +275,13 @@ def forward_applies(cats_left, cats_right):
     else:
         cats1 = cats_left.has_slash[slash.RAPPLY].all
     for cat1 in cats1:
-        if cat1.dom.shape is not None:
-            cats2 = cats_right.with_shape[cat1.dom.shape].all + \
-                cats_right.with_shape[None].all
-        else:
-            cats2 = cats_right.all
-        for cat2 in cats2:
-            sub = cat2.sub_unify(cat1.dom)
-            if sub is not None:
+        for cat2 in cats_right.unifiable(cat1.dom):
+            combination = combinators.compose(cat1, cat2)
+            if combination is not None:
+                result, sub = combination
                 functor = cat1.subst(sub)
                 argument = cat2.subst(sub)
-                result = functor.cod
+                result = result.subst(sub)
                 rule = '>'
                 # self.__graph[result].update([functor, argument])
                 results.append((result, rule, (functor, argument)))
@@ -282,17 +306,13 @@ def backward_applies(cats_left, cats_right):
         cats2 = cats_right.has_slash[slash.LAPPLY].all
 
     for cat2 in cats2:
-        if cat2.dom.shape is not None:
-            cats1 = cats_left.with_shape[cat2.dom.shape].all + \
-                cats_left.with_shape[None].all
-        else:
-            cats1 = cats_left.all
-        for cat1 in cats1:
-            sub = cat1.sub_unify(cat2.dom)
-            if sub is not None:
+        for cat1 in cats_left.unifiable(cat2.dom):
+            combination = combinators.compose(cat2, cat1)
+            if combination is not None:
+                result, sub = combination
                 functor = cat2.subst(sub)
                 argument = cat1.subst(sub)
-                result = functor.cod
+                result = result.subst(sub)
                 # self.__graph[result].update([functor, argument])
                 results.append((result, '<', (argument, functor)))
                 # print(f"ABA passing {argument} to {functor}")
@@ -320,14 +340,12 @@ def forward_composition1(cats_left, cats_right):
         cats2 = cats_right.has_slash[slash.RCOMPOSE] \
             .left.with_shape[common_shape].all
         for cat2 in cats2:
-            sub = cat2.cod.sub_unify(cat1.dom)
-            if sub is not None:
+            combination = combinators.compose(cat1, cat2, 1)
+            if combination is not None:
+                composition, sub = combination
                 primary = cat1.subst(sub)
                 secondary = cat2.subst(sub)
-                composition = category.SlashCategory(
-                    primary.cod,
-                    secondary.slash,
-                    secondary.dom)
+                composition = composition.subst(sub)
                 results.append(
                     (composition, '>B', (primary, secondary)))
                 # print(f"B1  {composition}  -->  "
@@ -350,14 +368,12 @@ def forward_composition2(cats_left, cats_right):
         cats2 = cats_right.left.has_slash[slash.RCOMPOSE] \
             .left.with_shape[common_shape].all
         for cat2 in cats2:
-            sub = cat2.cod.cod.sub_unify(cat1.dom)
-            if sub is not None:
+            combination = combinators.compose(cat1, cat2, 2)
+            if combination is not None:
+                composition, sub = combination
                 primary = cat1.subst(sub)
                 secondary = cat2.subst(sub)
-                composition = category.SlashCategory(
-                    category.SlashCategory(
-                        primary.cod, secondary.cod.slash, secondary.cod.dom),
-                    secondary.slash, secondary.dom)
+                composition = composition.subst(sub)
                 results.append(
                     (composition, '>B2', (primary, secondary)))
 
@@ -379,16 +395,12 @@ def forward_composition3(cats_left, cats_right):
         if SKIP_NONNORMAL:
             cats2 = cats2.without_rules({'>B2'})
         for cat2 in cats2.all:
-            sub = cat2.cod.cod.cod.sub_unify(cat1.dom)
-            if sub is not None:
+            combination = combinators.compose(cat1, cat2, 3)
+            if combination is not None:
+                composition, sub = combination
                 primary = cat1.subst(sub)
                 secondary = cat2.subst(sub)
-                composition = category.SlashCategory(
-                    category.SlashCategory(
-                        category.SlashCategory(
-                            primary.cod, secondary.cod.cod.slash, secondary.cod.cod.dom),
-                        secondary.cod.slash, secondary.cod.dom),
-                    secondary.slash, secondary.dom)
+                composition = composition.subst(sub)
                 results.append(
                     (composition, '>B3', (primary, secondary)))
 
@@ -408,14 +420,12 @@ def backward_composition1(cats_left, cats_right):
         cats1 = cats_left.has_slash[slash.LCOMPOSE] \
             .left.with_shape[common_shape]
         for cat1 in cats1.all:
-            sub = cat1.cod.sub_unify(cat2.dom)
-            if sub is not None:
+            combination = combinators.compose(cat2, cat1, 1)
+            if combination is not None:
+                composition, sub = combination
                 secondary = cat1.subst(sub)
                 primary = cat2.subst(sub)
-                composition = category.SlashCategory(
-                    primary.cod,
-                    secondary.slash,
-                    secondary.dom)
+                composition = composition.subst(sub)
                 results.append(
                     (composition, '<B', (secondary, primary)))
                 # print(f"B1  {composition}  -->  "
@@ -433,12 +443,12 @@ def backwards_cross_compose(cats_left, cats_right):
         cats2 = cats_right.has_slash[slash.LCROSS]. \
             right.with_shape[common_shape].all
         for cat2 in cats2:
-            sub = cat1.cod.sub_unify(cat2.dom)
-            if sub is not None:
+            combination = combinators.compose(cat2, cat1, 1)
+            if combination is not None:
+                composition, sub = combination
                 primary = cat2.subst(sub)
                 secondary = cat1.subst(sub)
-                composition = category.SlashCategory(
-                    primary.cod, secondary.slash, secondary.dom)
+                composition = composition.subst(sub)
                 results.append(
                     (composition, '<Bx', (secondary, primary)))
 
@@ -524,12 +534,15 @@ def typeraise(cat, rules):
 
 
 def build_graph(productions):
+    """Maps the code of each category to the codes of the categories
+       that its productions use"""
     graph = collections.defaultdict(set)
 
     for n, productions_n in productions.items():
         for cat, sources in productions_n.items():
+            code = TABLE.encode(cat)
             for whence, rule in sources:
-                graph[cat].update(whence)
+                graph[code].update(whence)
 
     return graph
 
@@ -539,23 +552,23 @@ def bfs(production_graph):
 
     # print(f'for constructing S   : {production_graph[category.S]}')
     print(
-        f'for constructing S/NP: {" ".join([category.alpha_normalized_string(c) for c in production_graph[category.SlashCategory(category.S, slash.RSLASH, category.NP)]])}')
+        f'for constructing S/NP: {" ".join([category.alpha_normalized_string(TABLE.decode(c)) for c in production_graph[TABLE.encode(category.SlashCategory(category.S, slash.RSLASH, category.NP))]])}')
 
     visited = set()
-    queue = [category.S]
+    queue = [TABLE.encode(category.S)]
 
     while queue:
         next = queue.pop(0)
-        assert(isinstance(next, category.BaseCategory) or isinstance(
-            next, category.SlashCategory) or isinstance(next, category.SingletonCategory))
         if next in visited:
             continue
+        assert(not isinstance(TABLE.decode(next), category.Metavar))
 
         visited.add(next)
         queue += list(production_graph[next])
 
+    visited = {TABLE.decode(code) for code in visited}
     all_visited = [category.alpha_normalized_string(c) for c in visited]
-    all_visited.sort(key=sort_key)
+    all_visited.sort(key=category.string_sort_key)
     # print(all_visited)
     print('   ', '  '.join(all_visited[:100]))
     print('   ', len(all_visited))
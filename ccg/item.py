@@ -2,12 +2,28 @@
 
 import formatting
 import functools
+import math
+
+
+class Recipe:
+    """Semantics not built yet: fn applied to the semantics of the
+       given items (see rules.LAZY_SEMANTICS)"""
+
+    __slots__ = ('fn', 'items')
+
+    def __init__(self, fn, *items):
+        self.fn = fn
+        self.items = items
+
+    def build(self):
+        return self.fn(*[item.sem for item in self.items])
 
 
 class Item:
     """
          .cat is the category of the parse
          .sem is the semantics of the parse
+                 (built on first use, if given as a Recipe)
          .why is the rule that constructed the item
                  (a list containing the rule name followed by
                   the input items --- unless it corresponds
@@ -17,8 +33,21 @@ class Item:
 
     def __init__(self, cat, sem, why=None):
         self.cat = cat
-        self.sem = sem
+        self.__sem = sem
         self.why = why
+        self.__signature = None
+
+    @property
+    def sem(self):
+        if isinstance(self.__sem, Recipe):
+            self.__sem = self.__sem.build()
+        return self.__sem
+
+    @property
+    def has_sem(self):
+        """Whether the item has semantics, built or not (the items of
+           a recognizing parse have none)"""
+        return self.__sem is not None
 
     def __str__(self):
         """Nice but compact representation of the category & semantics"""
@@ -36,7 +65,7 @@ class Item:
 
     def subst(self, sub):
         cat2 = self.cat.subst(sub)
-        sem2 = self.sem
+        sem2 = self.__sem    # a Recipe stays unbuilt
         why2 = self.why
         if (isinstance(self.why, list)):
             why2 = [x.subst(sub) if isinstance(x, Item) else x
@@ -107,3 +136,54 @@ class Item:
             return self.why[0]
         else:
             return ''
+
+    @property
+    def signature(self):
+        """A small summary of the item, which is all that the
+           preconditions of the binary rules look at: the slashes of
+           the category and of its first two codomains (or None), and
+           the name of the rule that produced the item."""
+        if self.__signature is None:
+            slashes = [sl for sl, _ in self.cat.info.args[:3]]
+            slashes += [None] * (3 - len(slashes))
+            self.__signature = (tuple(slashes), self.rule())
+        return self.__signature
+
+
+class PackedItem(Item):
+    """A node in a packed parse forest, standing for every derivation
+       of the same category and semantics (by the same final rule)
+       over one span of the input.
+         .derivations lists the alternative derivations, each in the
+                 same format as .why, except that the input items
+                 are themselves PackedItems
+         .why is the first of these derivations, so that a
+                 PackedItem can be used (and displayed) like an Item
+         .count is the number of derivations this stands for
+    """
+
+    def __init__(self, cat, sem, why=None):
+        super().__init__(cat, sem, why)
+        self.derivations = [why]
+        self.__count = None
+
+    def __repr__(self):
+        return f'PackedItem({self.cat!r},{self.sem!r},{self.why!r})'
+
+    def add_derivation(self, why):
+        """Record another way of deriving this item"""
+        self.derivations.append(why)
+        self.__count = None
+
+    @property
+    def count(self):
+        """The number of complete derivations of this node: for each of
+           its derivations, the product of the counts of the inputs.
+           It is worked out (exactly, however large) once and kept, so
+           read it only when the cells below are finished."""
+        if self.__count is None:
+            self.__count = sum(
+                math.prod(child.count for child in why[1:])
+                if isinstance(why, list) else 1
+                for why in self.derivations)
+        return self.__count
@@ -6,13 +6,74 @@ import functools
 
 import category
 import catparser
+import combinators
 import semantics
 import slash
-from item import Item
+from item import Item, Recipe
+
+# Build the semantics of derived items only when something reads them
+# (e.g., for the parses the caller keeps), rather than as the rules fire
+LAZY_SEMANTICS = False
+
+
+def semantics_of(build, *items):
+    """build applied to the semantics of the items: right away, or a
+       Recipe for doing so later if LAZY_SEMANTICS. Items without
+       semantics (as when recognizing, see chartparser.parse) give
+       None."""
+    if not all(item.has_sem for item in items):
+        return None
+    if LAZY_SEMANTICS:
+        return Recipe(build, *items)
+    return build(*[item.sem for item in items])
+
+
+def apply_sem(f, x):
+    """f(x)"""
+    return semantics.App(f, x).reduce()
+
+
+def compose_sem(f, g):
+    """λz. f(g(z))"""
+    return semantics.Lam(
+        "z",
+        semantics.App(
+            f,
+            semantics.App(
+                g,
+                semantics.BoundVar(0))).reduce())
+
+
+def compose2_sem(f, g):
+    """λw. λz. f(g(w)(z))"""
+    return semantics.Lam(
+        "w",
+        semantics.Lam(
+            "z",
+            semantics.App(
+                f,
+                semantics.App(
+                    semantics.App(
+                        g,
+                        semantics.BoundVar(1)),
+                    semantics.BoundVar(0))))).reduce()
+
 
+def raise_sem(x):
+    """λz. z(x)"""
+    return semantics.Lam("z",
+                         semantics.App(semantics.BoundVar(0), x.shift(1)))
 
-def deconstruct(item1, item2):
-    return (item1.cat, item1.sem, item2.cat, item2.sem)
+
+def conclude(cat, sem, why, sub):
+    """The item for the result of a rule, instantiated by sub (as from
+       combinators.compose), if any. Without semantics, only the rule
+       name is kept from why, as that and the category are all that
+       recognition needs."""
+    if sem is None:
+        return Item(cat if sub is None else cat.subst(sub), None, why[:1])
+    item = Item(cat, sem, why)
+    return item if sub is None else item.subst(sub)
 
 
 #######################
@@ -58,41 +119,47 @@ def deconstruct(item1, item2):
 #  (unnecessarily) lifted.
 
 
-def forward_application(item1, item2, dest):
-    cat1, sem1, cat2, sem2 = deconstruct(item1, item2)
-    # print(f'forward_application trying {cat1} @ {cat2}')
-    if not (isinstance(cat1, category.SlashCategory) and
+@functools.lru_cache(maxsize=None)
+def forward_application_ok(sig1, sig2):
+    (slash1, _, _), rule1 = sig1
+    _, rule2 = sig2
+    if not (slash1 is not None and
             # XXX: ^^^ overspecific, but only if we want to apply metavars.
-            slash.RSLASH <= cat1.slash):
-        # print(f' forward_application: nope 1')
+            slash.RSLASH <= slash1):
         return False  # not a function, or not looking rightwards
 
     # NB: application is a special (zero-ary) case of composition,
     #     so we can use the same constraint checking-function.
-    if compose_constraint_violation(item1, item2, 0, '>'):
-        # print("forward application constraint violation")
-        # print(item1)
-        # print(item2)
-        # print()
+    if compose_constraint_violation(rule1, rule2, 0, '>'):
         return False
 
-    if forbidden_combination(item1.why, item2.why, '>'):
+    if forbidden_combination(rule1, rule2, '>'):
+        return False
+
+    return True
+
+
+def forward_application(item1, item2, dest):
+    cat1, cat2 = item1.cat, item2.cat
+    # print(f'forward_application trying {cat1} @ {cat2}')
+    if not forward_application_ok(item1.signature, item2.signature):
         return False
 
-    sub = cat2.sub_unify(cat1.dom)
-    if sub is None:
+    combination = combinators.compose(cat1, cat2)
+    if combination is None:
         # print(f'forward_application: {cat2} <= {cat1.dom}: nope 2')
         return False  # application category mismatch
+    result, sub = combination
 
     label = '>'
     if slash.PHI in cat1.slash.mode:
         label += slash.PHI
-        if 'T' in item2.why[0]:
+        if 'T' in item2.rule():
             label += 'T'
 
-    dest += [Item(cat1.cod,
-                  semantics.App(sem1, sem2).reduce(),
-                  [label, item1, item2]).subst(sub)]
+    dest += [conclude(result,
+                      semantics_of(apply_sem, item1, item2),
+                      [label, item1, item2], sub)]
     return True
 
 ########################
@@ -127,267 +194,260 @@ def forward_application(item1, item2, dest):
 #      f(↑b)
 
 
-def backward_application(item1, item2, dest):
-    (cat1, sem1, cat2, sem2) = deconstruct(item1, item2)
-
-    if not (isinstance(cat2, category.SlashCategory) and
-            slash.LSLASH <= cat2.slash):
+@functools.lru_cache(maxsize=None)
+def backward_application_ok(sig1, sig2):
+    _, rule1 = sig1
+    (slash2, _, _), rule2 = sig2
+    if not (slash2 is not None and
+            slash.LSLASH <= slash2):
         return False  # not a function, or not looking leftwards
 
-    if compose_constraint_violation(item2, item1, 0, '<'):
-        # print(f"backward constraint violated; skipping")
-        # print(item1)
-        # print(item2)
-        # print()
+    if compose_constraint_violation(rule2, rule1, 0, '<'):
+        return False
+
+    if forbidden_combination(rule1, rule2, '<'):
         return False
 
-    if forbidden_combination(item1.why, item2.why, '<'):
+    return True
+
+
+def backward_application(item1, item2, dest):
+    cat1, cat2 = item1.cat, item2.cat
+
+    if not backward_application_ok(item1.signature, item2.signature):
         return False
 
-    sub = cat1.sub_unify(cat2.dom)
-    if sub is None:
+    combination = combinators.compose(cat2, cat1)
+    if combination is None:
         return False  # application category mismatch
+    result, sub = combination
 
     label = '<'
     if slash.PHI in cat2.slash.mode:
         label += slash.PHI
-        if 'T' in item1.why[0] and 'T' in item2.why[0]:
+        if 'T' in item1.rule() and 'T' in item2.rule():
             label += 'T'
 
-    dest += [Item(cat2.cod,
-                  semantics.App(sem2, sem1).reduce(),
-                  [label, item1, item2]).subst(sub)]
+    dest += [conclude(result,
+                      semantics_of(apply_sem, item2, item1),
+                      [label, item1, item2], sub)]
     return True
 
 
-def forward_composition(item1, item2, dest):
-    (cat1, sem1, cat2, sem2) = deconstruct(item1, item2)
-
-    if not(isinstance(cat1, category.SlashCategory) and
-           cat1.slash <= slash.RCOMPOSE and
-           isinstance(cat2, category.SlashCategory) and
-           cat2.slash <= slash.RCOMPOSE):
+@functools.lru_cache(maxsize=None)
+def forward_composition_ok(sig1, sig2):
+    (slash1, _, _), rule1 = sig1
+    (slash2, _, _), rule2 = sig2
+    if not(slash1 is not None and
+           slash1 <= slash.RCOMPOSE and
+           slash2 is not None and
+           slash2 <= slash.RCOMPOSE):
         return False  # not both rightwards functions
 
-    if compose_constraint_violation(item1, item2, 1, '>'):
-        # print("forward composition constraint violation")
-        # print(item1)
-        # print(item2)
-        # print()
+    if compose_constraint_violation(rule1, rule2, 1, '>'):
         return False
 
-    if forbidden_combination(item1.why, item2.why, '>B'):
+    if forbidden_combination(rule1, rule2, '>B'):
         return False
 
-    sub = cat2.cod.sub_unify(cat1.dom)
-    if sub is None:
+    return True
+
+
+def forward_composition(item1, item2, dest):
+    cat1, cat2 = item1.cat, item2.cat
+
+    if not forward_composition_ok(item1.signature, item2.signature):
+        return False
+
+    combination = combinators.compose(cat1, cat2, 1)
+    if combination is None:
         return False  # not composeable
+    result, sub = combination
 
-    final_slash = cat2.slash
-    dest += (
-        [Item(category.SlashCategory(cat1.cod, final_slash, cat2.dom),
-              semantics.Lam(
-                "z",
-                semantics.App(
-                    sem1,
-                    semantics.App(
-                        sem2,
-                        semantics.BoundVar(0))).reduce()),
-                ['>B', item1, item2]).subst(sub)])
+    dest += [conclude(result,
+                      semantics_of(compose_sem, item1, item2),
+                      ['>B', item1, item2], sub)]
     return True
 
 
-def forward_composition2(item1, item2, dest):
-    (cat1, sem1, cat2, sem2) = deconstruct(item1, item2)
-
-    if not(isinstance(cat1, category.SlashCategory) and
-           cat1.slash <= slash.RCOMPOSE and
-           isinstance(cat2, category.SlashCategory) and
-           isinstance(cat2.cod, category.SlashCategory) and
-           cat2.cod.slash <= slash.RCOMPOSE):
+@functools.lru_cache(maxsize=None)
+def forward_composition2_ok(sig1, sig2):
+    (slash1, _, _), rule1 = sig1
+    (_, cod_slash2, _), rule2 = sig2
+    if not(slash1 is not None and
+           slash1 <= slash.RCOMPOSE and
+           cod_slash2 is not None and
+           cod_slash2 <= slash.RCOMPOSE):
         return False  # not both rightwards functions
 
-    if compose_constraint_violation(item1, item2, 2, '>'):
-        # print("forward composition constraint violation")
-        # print(item1)
-        # print(item2)
-        # print()
+    if compose_constraint_violation(rule1, rule2, 2, '>'):
         return False
 
-    if forbidden_combination(item1.why, item2.why, '>B2'):
+    if forbidden_combination(rule1, rule2, '>B2'):
         return False
 
-    sub = cat2.cod.cod.sub_unify(cat1.dom)
-    if sub is None:
+    return True
+
+
+def forward_composition2(item1, item2, dest):
+    cat1, cat2 = item1.cat, item2.cat
+
+    if not forward_composition2_ok(item1.signature, item2.signature):
+        return False
+
+    combination = combinators.compose(cat1, cat2, 2)
+    if combination is None:
         return False  # not composeable
+    result, sub = combination
 
-    final_slash = cat2.cod.slash
-    dest += (
-        [Item(category.SlashCategory(
-            category.SlashCategory(cat1.cod, final_slash, cat2.cod.dom),
-            cat2.slash,
-            cat2.dom),
-            (semantics.Lam(
-                "w",
-                semantics.Lam(
-                    "z",
-                    semantics.App(
-                        sem1,
-                        semantics.App(
-                            semantics.App(
-                                sem2,
-                                semantics.BoundVar(1)),
-                            semantics.BoundVar(0))))).reduce()),
-            ['>B2', item1, item2]).subst(sub)])
+    dest += [conclude(result,
+                      semantics_of(compose2_sem, item1, item2),
+                      ['>B2', item1, item2], sub)]
     return True
 
 
-def backwards_composition(item1, item2, dest):
-    (cat1, sem1, cat2, sem2) = deconstruct(item1, item2)
-
-    if not(isinstance(cat1, category.SlashCategory) and
-           cat1.slash <= slash.LCOMPOSE and
-           isinstance(cat2, category.SlashCategory) and
-           cat2.slash <= slash.LCOMPOSE):
+@functools.lru_cache(maxsize=None)
+def backwards_composition_ok(sig1, sig2):
+    (slash1, _, _), rule1 = sig1
+    (slash2, _, _), rule2 = sig2
+    if not(slash1 is not None and
+           slash1 <= slash.LCOMPOSE and
+           slash2 is not None and
+           slash2 <= slash.LCOMPOSE):
         return False  # not both leftwards functions
 
-    if compose_constraint_violation(item2, item1, 1, '<'):
-        # print("<B constraint violation")
-        # print(item1)
-        # print(item2)
-        # print()
+    if compose_constraint_violation(rule2, rule1, 1, '<'):
         return False
 
-    if forbidden_combination(item1.why, item2.why, '<B1'):
+    if forbidden_combination(rule1, rule2, '<B1'):
         return False
 
-    sub = cat1.cod.sub_unify(cat2.dom)
-    if sub is None:
+    return True
+
+
+def backwards_composition(item1, item2, dest):
+    cat1, cat2 = item1.cat, item2.cat
+
+    if not backwards_composition_ok(item1.signature, item2.signature):
+        return False
+
+    combination = combinators.compose(cat2, cat1, 1)
+    if combination is None:
         return False  # not composeable
+    result, sub = combination
 
-    final_slash = cat1.slash
-    dest += (
-        [Item(category.SlashCategory(cat2.cod, final_slash, cat1.dom),
-              semantics.Lam(
-                "z",
-                semantics.App(
-                    sem2,
-                    semantics.App(
-                        sem1,
-                        semantics.BoundVar(0))).reduce()),
-                ['<B', item1, item2]).subst(sub)])
+    dest += [conclude(result,
+                      semantics_of(compose_sem, item2, item1),
+                      ['<B', item1, item2], sub)]
     return True
 
 
-def backwards_composition2(item1, item2, dest):
-    (cat1, sem1, cat2, sem2) = deconstruct(item1, item2)
-
-    if not(isinstance(cat1, category.SlashCategory) and
-           isinstance(cat1.cod, category.SlashCategory) and
-           cat1.cod.slash <= slash.LCOMPOSE and
-           isinstance(cat2, category.SlashCategory) and
-           cat2.slash <= slash.LCOMPOSE):
+@functools.lru_cache(maxsize=None)
+def backwards_composition2_ok(sig1, sig2):
+    (_, cod_slash1, _), rule1 = sig1
+    (slash2, _, _), rule2 = sig2
+    if not(cod_slash1 is not None and
+           cod_slash1 <= slash.LCOMPOSE and
+           slash2 is not None and
+           slash2 <= slash.LCOMPOSE):
         return False  # not both leftwards functions
 
-    if compose_constraint_violation(item2, item1, 2, '<'):
-        # print("<B constraint violation")
-        # print(item1)
-        # print(item2)
-        # print()
+    if compose_constraint_violation(rule2, rule1, 2, '<'):
         return False
 
-    if forbidden_combination(item1.why, item2.why, '<B2'):
+    if forbidden_combination(rule1, rule2, '<B2'):
         return False
 
-    sub = cat1.cod.cod.sub_unify(cat2.dom)
-    if sub is None:
+    return True
+
+
+def backwards_composition2(item1, item2, dest):
+    cat1, cat2 = item1.cat, item2.cat
+
+    if not backwards_composition2_ok(item1.signature, item2.signature):
+        return False
+
+    combination = combinators.compose(cat2, cat1, 2)
+    if combination is None:
         return False  # not composeable
+    result, sub = combination
 
-    final_slash = cat1.cod.slash
-    dest += (
-        [Item(category.SlashCategory(
-                        category.SlashCategory(
-                            cat2.cod, final_slash, cat1.cod.dom),
-                        cat1.slash,
-                        cat1.dom),
-              semantics.Lam(
-                "w",
-                semantics.Lam(
-                    "z",
-                    semantics.App(
-                        sem2,
-                        semantics.App(
-                            semantics.App(
-                                sem1,
-                                semantics.BoundVar(1)),
-                            semantics.BoundVar(0))))).reduce(),
-              ['<B2', item1, item2]).subst(sub)])
+    dest += [conclude(result,
+                      semantics_of(compose2_sem, item2, item1),
+                      ['<B2', item1, item2], sub)]
     return True
 
 
-def forward_crossed_composition(item1, item2, dest):
-    (cat1, sem1, cat2, sem2) = deconstruct(item1, item2)
-
-    if not(isinstance(cat1, category.SlashCategory) and
-           cat1.slash <= slash.mk_rslash(slash.ALLOWBX) and
-           isinstance(cat2, category.SlashCategory) and
-           cat2.slash <= slash.mk_lslash(slash.ALLOWBX)):
+@functools.lru_cache(maxsize=None)
+def forward_crossed_composition_ok(sig1, sig2):
+    (slash1, _, _), rule1 = sig1
+    (slash2, _, _), rule2 = sig2
+    if not(slash1 is not None and
+           slash1 <= slash.mk_rslash(slash.ALLOWBX) and
+           slash2 is not None and
+           slash2 <= slash.mk_lslash(slash.ALLOWBX)):
         return False  # not appropriate slash categories
 
-    if compose_constraint_violation(item1, item2, 1, '>'):
+    if compose_constraint_violation(rule1, rule2, 1, '>'):
         return False
 
-    if forbidden_combination(item1.why, item2.why, '>Bx'):
+    if forbidden_combination(rule1, rule2, '>Bx'):
         return False
 
-    sub = cat2.cod.sub_unify(cat1.dom)
-    if sub is None:
+    return True
+
+
+def forward_crossed_composition(item1, item2, dest):
+    cat1, cat2 = item1.cat, item2.cat
+
+    if not forward_crossed_composition_ok(item1.signature, item2.signature):
+        return False
+
+    combination = combinators.compose(cat1, cat2, 1)
+    if combination is None:
         return False  # not composeable
+    result, sub = combination
 
-    final_slash = cat2.slash
-    dest += (
-        [Item(category.SlashCategory(cat1.cod, final_slash, cat2.dom),
-              semantics.Lam(
-                "z",
-                semantics.App(
-                    sem1,
-                    semantics.App(
-                        sem2,
-                        semantics.BoundVar(0))).reduce()),
-                ['>Bx', item1, item2]).subst(sub)])
+    dest += [conclude(result,
+                      semantics_of(compose_sem, item1, item2),
+                      ['>Bx', item1, item2], sub)]
     return True
 
 
-def backwards_crossed_composition(item1, item2, dest):
-    (cat1, sem1, cat2, sem2) = deconstruct(item1, item2)
-
-    if not(isinstance(cat1, category.SlashCategory) and
-           cat1.slash <= slash.mk_rslash(slash.ALLOWBX) and
-           isinstance(cat2, category.SlashCategory) and
-           cat2.slash <= slash.mk_lslash(slash.ALLOWBX)):
+@functools.lru_cache(maxsize=None)
+def backwards_crossed_composition_ok(sig1, sig2):
+    (slash1, _, _), rule1 = sig1
+    (slash2, _, _), rule2 = sig2
+    if not(slash1 is not None and
+           slash1 <= slash.mk_rslash(slash.ALLOWBX) and
+           slash2 is not None and
+           slash2 <= slash.mk_lslash(slash.ALLOWBX)):
         return False  # not both leftwards functions
 
-    if compose_constraint_violation(item2, item1, 1, '<'):
+    if compose_constraint_violation(rule2, rule1, 1, '<'):
         return False
 
-    if forbidden_combination(item1.why, item2.why, '<Bx'):
+    if forbidden_combination(rule1, rule2, '<Bx'):
         return False
 
-    sub = cat1.cod.sub_unify(cat2.dom)
-    if sub is None:
+    return True
+
+
+def backwards_crossed_composition(item1, item2, dest):
+    cat1, cat2 = item1.cat, item2.cat
+
+    if not backwards_crossed_composition_ok(item1.signature,
+                                            item2.signature):
+        return False
+
+    combination = combinators.compose(cat2, cat1, 1)
+    if combination is None:
         return False  # not composeable
+    result, sub = combination
 
-    final_slash = cat1.slash
-    dest += (
-        [Item(category.SlashCategory(cat2.cod, final_slash, cat1.dom),
-              semantics.Lam(
-                "z",
-                semantics.App(
-                    sem2,
-                    semantics.App(
-                        sem1,
-                        semantics.BoundVar(0))).reduce()),
-                ['<Bx', item1, item2]).subst(sub)])
+    dest += [conclude(result,
+                      semantics_of(compose_sem, item2, item1),
+                      ['<Bx', item1, item2], sub)]
     return True
 
 
@@ -396,7 +456,7 @@ c_arg = [category.NP, category.S, category.VBI]
 
 def typeraise_constraint_violation(item, dir='>'):
     # NF Constraint 6
-    if slash.PHI in item.why[0]:
+    if slash.PHI in item.rule():
         return True
     return False
 
@@ -404,28 +464,24 @@ def typeraise_constraint_violation(item, dir='>'):
 def typeraise_right(T, item, dest):
     if typeraise_constraint_violation(item, '>'):
         return
-    dest += [Item(
+    dest += [conclude(
         category.SlashCategory(
             T, slash.RSLASH,
             category.SlashCategory(T, slash.LSLASH, item.cat)),
-        semantics.Lam("z",
-                      semantics.App(semantics.BoundVar(0),
-                                    item.sem.shift(1))),
-        ['>T', item])
+        semantics_of(raise_sem, item),
+        ['>T', item], None)
     ]
 
 
 def typeraise_left(T, item, dest):
     if typeraise_constraint_violation(item, '<'):
         return
-    dest += [Item(
+    dest += [conclude(
         category.SlashCategory(
             T, slash.LSLASH,
             category.SlashCategory(T, slash.RSLASH, item.cat)),
-        semantics.Lam("z",
-                      semantics.App(semantics.BoundVar(0),
-                                    item.sem.shift(1))),
-        ['<T', item])
+        semantics_of(raise_sem, item),
+        ['<T', item], None)
     ]
 
 
@@ -489,10 +545,13 @@ def typeraise_generic(item, dest):
     typeraise_left(T, item, dest)
 
 
-def compose_constraint_violation(item1, item2, n, dir='>'):
+def compose_constraint_violation(rule1, rule2, n, dir='>'):
+    """Checks the normal-form constraints, given the names of the
+       rules that produced the primary (rule1) and secondary (rule2)
+       inputs of an order-n composition in the given direction."""
     DEBUG = False
     if DEBUG:
-        print(f'ccv {item1.cat} {item2.cat} {n} {dir}')
+        print(f'ccv {rule1} {rule2} {n} {dir}')
     # Hockenmaier and Bisk NF Constraint 1:
     # Forbid
     #   X/A  A/Y[1..k]/C
@@ -509,9 +568,9 @@ def compose_constraint_violation(item1, item2, n, dir='>'):
     #   ------------------------------ >B1
     #          X/Y[1..k]/D
     if (n == 0 or n == 1):
-        if item1.rule().startswith(dir+'B'):
+        if rule1.startswith(dir+'B'):
             # possible violation; but check that it's B(k+1), not B0
-            if item1.rule() not in [dir+'B0', dir]:
+            if rule1 not in [dir+'B0', dir]:
                 if DEBUG:
                     print("constraint 1")
                 return True
@@ -531,7 +590,7 @@ def compose_constraint_violation(item1, item2, n, dir='>'):
     #           A/D[1..n]
 
     if (n > 1):
-        if (item1.why and item1.why[0] in [dir+'B', dir+'B1']):
+        if rule1 in [dir+'B', dir+'B1']:
             if DEBUG:
                 print("constraint 2")
             return True
@@ -549,9 +608,9 @@ def compose_constraint_violation(item1, item2, n, dir='>'):
     #        A/C[1..k]/D                    D/E[1..m]
     #   ------------------------------------------------ >Bm
     #                      A/C[1..k]/E[1..m]
-    if (item2.why and item2.why[0].startswith(dir+'B') and
-            ((not item2.why[0][-1].isdigit() and 1 < n) or
-             (item2.why[0][-1].isdigit() and int(item2.why[0][-1]) < n))):
+    if (rule2.startswith(dir+'B') and
+            ((not rule2[-1].isdigit() and 1 < n) or
+             (rule2[-1].isdigit() and int(rule2[-1]) < n))):
         if DEBUG:
             print("constraint 3")
         return True
@@ -570,9 +629,9 @@ def compose_constraint_violation(item1, item2, n, dir='>'):
 
     if (n > 0):
         opdir = '<' if dir == '>' else '>'
-        if (item1.why and item1.why[0].startswith(dir+'T') and
-            item2.why and item2.why[0].startswith(opdir+'B') and
-                item2.why[0][-1].isdigit() and int(item2.why[0][-1]) > n):
+        if (rule1.startswith(dir+'T') and
+            rule2.startswith(opdir+'B') and
+                rule2[-1].isdigit() and int(rule2[-1]) > n):
             if DEBUG:
                 print("constraint 4")
             return True
@@ -589,7 +648,7 @@ def compose_constraint_violation(item1, item2, n, dir='>'):
     #    ------------- >
     #         A
     if (n == 0):
-        if item1.why and item1.why[0].startswith(dir + 'T'):
+        if rule1.startswith(dir + 'T'):
             if DEBUG:
                 print("constraint 5")
             return True
@@ -597,7 +656,7 @@ def compose_constraint_violation(item1, item2, n, dir='>'):
     # print("no constraint")
     return False
 
-def forbidden_combination(why_left, why_right, conclusion_rulename):
+def forbidden_combination(rule_left, rule_right, conclusion_rulename):
     #
     #  Hockenmaier and Bisk 2004, page 467
     #
@@ -614,8 +673,7 @@ def forbidden_combination(why_left, why_right, conclusion_rulename):
     #   -------------------------- >Bx
     #         X \ (Y / A)
 
-    if why_right is not None and \
-        why_right[0].startswith('<T') and \
+    if rule_right.startswith('<T') and \
             conclusion_rulename.startswith('>Bx'):
         return True
 
@@ -630,8 +688,7 @@ def forbidden_combination(why_left, why_right, conclusion_rulename):
     #   ------------------------------ <Bx
     #             X / (Y \ A)
 
-    if why_left is not None and \
-        why_left[0].startswith('>T') and \
+    if rule_left.startswith('>T') and \
         conclusion_rulename.startswith('<Bx'):
         return True
 
@@ -727,6 +784,83 @@ def test_gfc():
     assert ans9[0].why[0] == '>B0'
 
 
+def slashes_where(test):
+    return frozenset(sl for sl in slash.ALL_SLASHES if test(sl))
+
+
+# How each binary rule finds the pairs of items it might combine:
+#   which input is the functor (0 for the left, 1 for the right),
+#   the slashes that functor is allowed to have, and the depth d such
+#   that the d-th codomain of the other input must unify with the
+#   functor's domain (0 for application, 1 for composition, ...).
+# Chart cells are indexed on these, so that (e.g.) forward application
+# pairs each X/Y only with the items whose shape matches Y's.
+PARTNERS = {
+    forward_application:
+        (0, slashes_where(lambda sl: slash.RSLASH <= sl), 0),
+    backward_application:
+        (1, slashes_where(lambda sl: slash.LSLASH <= sl), 0),
+    forward_composition:
+        (0, slashes_where(lambda sl: sl <= slash.RCOMPOSE), 1),
+    forward_composition2:
+        (0, slashes_where(lambda sl: sl <= slash.RCOMPOSE), 2),
+    backwards_composition:
+        (1, slashes_where(lambda sl: sl <= slash.LCOMPOSE), 1),
+    backwards_composition2:
+        (1, slashes_where(lambda sl: sl <= slash.LCOMPOSE), 2),
+    forward_crossed_composition:
+        (0, slashes_where(lambda sl: sl <= slash.RCROSS), 1),
+    backwards_crossed_composition:
+        (1, slashes_where(lambda sl: sl <= slash.LCROSS), 1),
+}
+
+
+# The precondition of each binary rule, as a function of the signatures
+# (see Item.signature) of its two inputs.
+PRECONDITIONS = {
+    forward_application: forward_application_ok,
+    backward_application: backward_application_ok,
+    forward_composition: forward_composition_ok,
+    forward_composition2: forward_composition2_ok,
+    backwards_composition: backwards_composition_ok,
+    backwards_composition2: backwards_composition2_ok,
+    forward_crossed_composition: forward_crossed_composition_ok,
+    backwards_crossed_composition: backwards_crossed_composition_ok,
+}
+
+
+class DispatchTable:
+    """For a list of binary rules, the ones that might apply to a pair
+       of items with the given signatures (i.e., all but the ones whose
+       preconditions fail). Rules without a known precondition are
+       always included."""
+
+    def __init__(self, binary_rules):
+        self.__rules = list(binary_rules)
+        self.__table = {}
+
+    def rules_for(self, sig1, sig2):
+        key = (sig1, sig2)
+        if key not in self.__table:
+            self.__table[key] = \
+                [rule for rule in self.__rules
+                 if rule not in PRECONDITIONS or
+                 PRECONDITIONS[rule](sig1, sig2)]
+        return self.__table[key]
+
+
+DISPATCH_TABLES = {}
+
+
+def dispatch_table(binary_rules):
+    """The DispatchTable for the given rules, which is shared across
+       all cells and sentences"""
+    key = tuple(binary_rules)
+    if key not in DISPATCH_TABLES:
+        DISPATCH_TABLES[key] = DispatchTable(binary_rules)
+    return DISPATCH_TABLES[key]
+
+
 parsingRules = [[typeraise_simple],
                 [forward_application,
                  backward_application,
@@ -0,0 +1,97 @@
+"""
+Score functions for ranking derivations.
+
+A score function takes an item and its derivation (the item's why,
+see Item) and returns the cost of that last step, a nonnegative
+number; the cost of a whole derivation is the sum over its steps.
+"""
+
+import collections
+import math
+import weakref
+
+from item import PackedItem
+
+
+def derivation_size(item, why):
+    """Every step costs 1, so the cheapest derivations are the
+       smallest trees."""
+    return 1
+
+
+def category_frequency(cat_dict, step_cost=0, key=str):
+    """Returns a score function charging each lexical step
+       -log P(category | word), estimated with add-one smoothing from
+       the counts in cat_dict (as returned by ccgbank.process_lexicon),
+       and each rule step step_cost. key(cat) should give the string
+       that the lexicon file would use for the category cat."""
+    counts = collections.defaultdict(collections.Counter)
+    for cat, lines in cat_dict.items():
+        for count, word in lines:
+            counts[word.lower()][cat] += count
+    totals = {word: sum(cats.values()) for word, cats in counts.items()}
+    ncats = len(cat_dict)
+
+    def score(item, why):
+        if isinstance(why, list):
+            return step_cost
+        cats = counts.get(why)
+        n = cats[key(item.cat)] if cats else 0
+        return -math.log((n + 1) / (totals.get(why, 0) + ncats + 1))
+
+    return score
+
+
+def cost(item, score):
+    """The total cost of the derivation of a (non-packed) item"""
+    why = item.why
+    total = score(item, why)
+    if isinstance(why, list):
+        total += sum(cost(child, score) for child in why[1:])
+    return total
+
+
+class Beam:
+    """Limits on the items kept in each cell of the chart (see
+       chartparser.fillCell): at most width of them, and only those
+       costing at most threshold more than the cell's cheapest item.
+       The cost of an item is that of its cheapest derivation
+       according to score. Either limit may be None."""
+
+    def __init__(self, width=None, threshold=None, score=derivation_size):
+        self.width = width
+        self.threshold = threshold
+        self.score = score
+        # maps id(node) to (weak reference to node, cost) for the live
+        #  PackedItems seen so far; the entry goes when the node does,
+        #  so a Beam used for many sentences does not keep their charts.
+        self.__costs = {}
+
+    def cost(self, item):
+        """The cost of the cheapest derivation of the item"""
+        if not isinstance(item, PackedItem):
+            return cost(item, self.score)
+        key = id(item)
+        if key not in self.__costs:
+            best = min(self.score(item, why) +
+                       (sum(self.cost(child) for child in why[1:])
+                        if isinstance(why, list) else 0)
+                       for why in item.derivations)
+            costs = self.__costs
+            self.__costs[key] = (
+                weakref.ref(item, lambda _, key=key: costs.pop(key, None)),
+                best)
+        return self.__costs[key][1]
+
+    def prune(self, items):
+        """The items that fit in the beam, in their original order"""
+        if self.width is None and self.threshold is None:
+            return list(items)
+        costs = [self.cost(item) for item in items]
+        ranked = sorted(range(len(items)), key=costs.__getitem__)
+        if self.width is not None:
+            ranked = ranked[:self.width]
+        if self.threshold is not None and costs:
+            limit = min(costs) + self.threshold
+            ranked = [n for n in ranked if costs[n] <= limit]
+        return [items[n] for n in sorted(ranked)]
@@ -16,6 +16,9 @@ class BaseType:
         return (isinstance(other, BaseType) and
                 self.name == other.name)
 
+    def __hash__(self):
+        return hash(self.__name)
+
 
 class ArrowType:
     def __init__(self, dom, cod):
@@ -44,6 +47,9 @@ class ArrowType:
                 self.dom == other.dom and
                 self.cod == other.cod)
 
+    def __hash__(self):
+        return hash((self.__dom, self.__cod))
+
 
 e = BaseType('e')
 t = BaseType('t')
@@ -6,12 +6,68 @@ Created on Fri Jun  2 15:50:07 2017
 @author: stone
 """
 
+import pickle
 import pyrsistent
+import sys
+import weakref
+
+# Terms are hash-consed: constructing a term equal to one that already
+#  exists (with the same Lam hints, too) returns the existing object.
+#  Equality still ignores the hints of Lams, as it always has, so terms
+#  are compared by their canonical forms: the same term with every hint
+#  replaced by CANONICAL_HINT. Two terms are equal exactly when their
+#  canonical forms are the same object.
+
+CANONICAL_HINT = ''
+
+USE_NBE = True   # reduce with normalize, rather than by substitution
+
+# Weak references to the terms currently in use, by constructor arguments
+#  (using the ids of the subterms, which the terms themselves keep alive).
+#  This does the job of a WeakValueDictionary, but faster.
+_interned = {}
+
+
+def _lookup(key):
+    ref = _interned.get(key)
+    return None if ref is None else ref()
+
+
+def _intern(key, term):
+    def forget(ref):
+        if _interned.get(key) is ref:
+            del _interned[key]
+    _interned[key] = weakref.ref(term, forget)
 
 
 class Const:
-    def __init__(self, nm: str):
-        self.__name = nm
+    __slots__ = ('__name', '__hash', '__weakref__')
+
+    def __new__(cls, nm: str):
+        key = ('c', nm)
+        self = _lookup(key)
+        if self is None:
+            self = super().__new__(cls)
+            self.__name = sys.intern(nm)
+            self.__hash = hash(key)
+            _intern(key, self)
+        return self
+
+    def __reduce__(self):
+        return (Const, (self.__name,))
+
+    # 1 + the largest free de Bruijn index in the term (0 if none);
+    #  shift and subst leave a term alone if it has none that they touch
+    free = 0
+
+    normal = True   # known to be in normal form
+
+    @property
+    def canonical(self):
+        return self
+
+    def __hash__(self):
+        return self.__hash
 
     @property
     def name(self):
@@ -27,8 +83,7 @@ class Const:
         return f'Const({self.name!r})'
 
     def __eq__(self, other):
-        return (isinstance(other, Const) and
-                self.name == other.name)
+        return self is other
 
     def shift(self, delta, base=0):
         return self
@@ -39,6 +94,11 @@ class Const:
     def reduce(self):
         return self
 
+    def evaluate(self, env):
+        """The value of the term (see normalize), given the values
+           of its free variables"""
+        return self
+
     def deBruijn(self, numbering=pyrsistent.m()):
         if self.__name in numbering:
             return BoundVar(len(numbering) - numbering[self.__name] - 1)
@@ -51,8 +111,37 @@ class Const:
 
 
 class BoundVar:
-    def __init__(self, n):
-        self.__num = n
+    __slots__ = ('__num', '__hash', '__weakref__')
+
+    def __new__(cls, n):
+        key = ('v', n)
+        self = _lookup(key)
+        if self is None:
+            self = super().__new__(cls)
+            self.__num = n
+            self.__hash = hash(key)
+            _intern(key, self)
+        return self
+
+    def __reduce__(self):
+        return (BoundVar, (self.__num,))
+
+    @property
+    def free(self):
+        return self.__num + 1
+
+    normal = True
+
+    @property
+    def num(self):
+        return self.__num
+
+    @property
+    def canonical(self):
+        return self
+
+    def __hash__(self):
+        return self.__hash
 
     def toString(self, stack=[], applied=False):
         if (0 <= self.__num < len(stack)):
@@ -67,8 +156,7 @@ class BoundVar:
         return f'BoundVar({self.__num})'
 
     def __eq__(self, other):
-        return (isinstance(other, BoundVar) and
-                self.__num == other.__num)
+        return self is other
 
     def shift(self, delta, base=0):
         if self.__num >= base:
@@ -85,6 +173,9 @@ class BoundVar:
     def reduce(self):
         return self
 
+    def evaluate(self, env):
+        return env[self.__num]
+
     def deBruijn(self, numbering=pyrsistent.m()):
         return self
 
@@ -98,9 +189,59 @@ def beta(body, arg):
 
 
 class App:
-    def __init__(self, left, right):
-        self.__left = left.reduce()
-        self.__right = right.reduce()
+    __slots__ = ('__left', '__right', '__hash', '__free', '__canonical',
+                 '__reduced', '__weakref__')
+
+    def __new__(cls, left, right):
+        left = left.reduce()
+        right = right.reduce()
+        key = ('@', id(left), id(right))
+        self = _lookup(key)
+        if self is None:
+            self = super().__new__(cls)
+            self.__left = left
+            self.__right = right
+            self.__hash = hash((left, right))
+            self.__free = max(left.free, right.free)
+            self.__canonical = None
+            self.__reduced = None
+            _intern(key, self)
+        return self
+
+    def __reduce__(self):
+        return (App, (self.__left, self.__right))
+
+    @property
+    def free(self):
+        return self.__free
+
+    @property
+    def normal(self):
+        """Is the term known to be in normal form?"""
+        return self.__reduced is True
+
+    @staticmethod
+    def known_normal(left, right):
+        """App(left, right), which the caller knows to be normal"""
+        self = App(left, right)
+        self.__reduced = True
+        return self
+
+    @property
+    def canonical(self):
+        # computed when first needed; True stands for self (to avoid
+        #  a reference cycle)
+        if self.__canonical is None:
+            left = self.__left.canonical
+            right = self.__right.canonical
+            if left is self.__left and right is self.__right:
+                self.__canonical = True
+            else:
+                self.__canonical = App(left, right)
+        return self if self.__canonical is True else self.__canonical
+
+    def __hash__(self):
+        return self.__hash
 
     def toString(self, stack=[], applied=False):
         left = self.__left.toString(stack, True)
@@ -115,18 +256,30 @@ class App:
         return f'App({self.__left!r},{self.__right!r})'
 
     def __eq__(self, other):
-        return (isinstance(other, App) and
-                self.__left == other.__left and
-                self.__right == other.__right)
+        return self is other or \
+            (isinstance(other, App) and self.__hash == other.__hash and
+             self.canonical is other.canonical)
 
     def shift(self, delta, base=0):
+        if self.__free <= base:
+            return self
         return App(self.__left.shift(delta, base),
                    self.__right.shift(delta, base))
 
     def subst(self, k, e):
+        if self.__free <= k:
+            return self
         return App(self.__left.subst(k, e), self.__right.subst(k, e))
 
     def reduce(self):
+        # Terms never change, so the answer is worked out just once
+        #  (with True standing for self, as in canonical)
+        if self.__reduced is None:
+            reduced = normalize(self) if USE_NBE else self.__reduce()
+            self.__reduced = True if reduced is self else reduced
+        return self if self.__reduced is True else self.__reduced
+
+    def __reduce(self):
         # if self.__right == Const("_", 0):
         #     return self.__left.reduce()
         if isinstance(self.left, Lam):
@@ -142,6 +295,11 @@ class App:
 
         return self
 
+    def evaluate(self, env):
+        if self.__free == 0 and self.__reduced is True:
+            return self
+        return _apply(self.__left.evaluate(env), self.__right.evaluate(env))
+
     @property
     def left(self):
         return self.__left
@@ -161,9 +319,49 @@ class App:
 
 
 class Lam:
-    def __init__(self, hint, body):
-        self.__hint = hint
-        self.__body = body.reduce()
+    __slots__ = ('__hint', '__body', '__hash', '__free', '__canonical',
+                 '__weakref__')
+
+    def __new__(cls, hint, body):
+        body = body.reduce()
+        key = ('λ', hint, id(body))
+        self = _lookup(key)
+        if self is None:
+            self = super().__new__(cls)
+            self.__hint = sys.intern(hint)
+            self.__body = body
+            self.__hash = hash(('λ', body))
+            self.__free = max(body.free - 1, 0)
+            self.__canonical = None
+            _intern(key, self)
+        return self
+
+    def __reduce__(self):
+        return (Lam, (self.__hint, self.__body))
+
+    @property
+    def free(self):
+        return self.__free
+
+    normal = True   # as the body was reduced when the Lam was built
+
+    @property
+    def hint(self):
+        return self.__hint
+
+    @property
+    def canonical(self):
+        # as for App
+        if self.__canonical is None:
+            body = self.__body.canonical
+            if self.__hint == CANONICAL_HINT and body is self.__body:
+                self.__canonical = True
+            else:
+                self.__canonical = Lam(CANONICAL_HINT, body)
+        return self if self.__canonical is True else self.__canonical
+
+    def __hash__(self):
+        return self.__hash
 
     def toString(self, stack=[], applied=False):
         ident = self.__hint
@@ -180,18 +378,28 @@ class Lam:
         return f'Lam({self.__hint!r},{self.__body!r})'
 
     def __eq__(self, other):
-        return (isinstance(other, Lam) and
-                self.__body == other.__body)
+        return self is other or \
+            (isinstance(other, Lam) and self.__hash == other.__hash and
+             self.canonical is other.canonical)
 
     def shift(self, delta, base=0):
+        if self.__free <= base:
+            return self
         return Lam(self.__hint, self.__body.shift(delta, base+1))
 
     def subst(self, k, e):
+        if self.__free <= k:
+            return self
         return Lam(self.__hint, self.__body.subst(k+1, e.shift(1)))
 
     def reduce(self):
         return self
 
+    def evaluate(self, env):
+        if self.__free == 0:
+            return self
+        return _Closure(self.__hint, self.__body, env)
+
     @property
     def body(self):
         return self.__body
@@ -206,6 +414,85 @@ class Lam:
         return (self, [])
 
 
+##############################
+# NORMALIZATION BY EVALUATION #
+##############################
+
+# normalize evaluates a term to a value, in an environment giving the
+#  values of its bound variables, and then reads the value back as a
+#  term. Functions evaluate to closures, which are only evaluated
+#  (once) when applied, and free variables to neutral values.
+#  Closed normal subterms are not evaluated at all, unless applied:
+#  they are their own values, and are simply put back as they are.
+
+
+class _Neutral:
+    """A head (a Const, or the level of a variable, counting binders
+       from the outside in) applied to argument values, the first n of
+       which (if n > 0) make up the closed normal term prefix"""
+    __slots__ = ('head', 'args', 'prefix', 'n')
+
+    def __init__(self, head, args=(), prefix=None, n=0):
+        self.head = head
+        self.args = args
+        self.prefix = prefix
+        self.n = n
+
+
+class _Closure:
+    """A Lam body together with the values of its free variables"""
+    __slots__ = ('hint', 'body', 'env')
+
+    def __init__(self, hint, body, env):
+        self.hint = hint
+        self.body = body
+        self.env = env
+
+
+def _apply(f, arg):
+    kind = type(f)
+    if kind is _Closure:
+        return f.body.evaluate((arg,) + f.env)
+    elif kind is Lam:
+        return f.body.evaluate((arg,))
+    elif kind is not _Neutral:
+        head, args = f.spine
+        f = _Neutral(head, tuple(args), f, len(args))
+    head, args = f.head, f.args
+    if len(args) == 2 and isinstance(head, Const) and \
+       head.name in {'and', 'or'}:
+        # special case: (and a b)c => and (a c) (b c)
+        return _Neutral(head, (_apply(args[0], arg), _apply(args[1], arg)))
+    return _Neutral(head, args + (arg,), f.prefix, f.n)
+
+
+def _quote(value, depth):
+    kind = type(value)
+    if kind is _Closure:
+        var = _Neutral(depth)
+        return Lam(value.hint,
+                   _quote(value.body.evaluate((var,) + value.env), depth + 1))
+    elif kind is not _Neutral:
+        return value
+    head = value.head
+    if value.n > 0:
+        term = value.prefix
+    elif isinstance(head, Const):
+        term = head
+    else:
+        term = BoundVar(depth - head - 1)
+    for arg in value.args[value.n:]:
+        term = App.known_normal(term, _quote(arg, depth))
+    return term
+
+
+def normalize(term):
+    """The normal form of the term (see App.reduce)"""
+    depth = term.free
+    env = tuple(_Neutral(depth - 1 - n) for n in range(depth))
+    return _quote(term.evaluate(env), depth)
+
+
 def test_beta():
     assert (App(Lam("x", BoundVar(0)), Const("c")).reduce() == Const("c"))
     assert (App(Lam("x", Lam("y", BoundVar(0))), Const("c")).reduce() ==
@@ -219,6 +506,27 @@ def test_beta():
     assert BoundVar(0) != BoundVar(1)
 
 
+def test_normalize():
+    f = Lam("f", Lam("x", App(BoundVar(1), App(BoundVar(1), BoundVar(0)))))
+    term = App(App(f, Lam("y", App(Const("g"), BoundVar(0)))), Const("c"))
+    assert normalize(term) == App(Const("g"), App(Const("g"), Const("c")))
+    # free variables stay put, under binders too
+    term = App(Lam("x", Lam("y", App(BoundVar(1), BoundVar(2)))), BoundVar(0))
+    assert normalize(term) == Lam("y", App(BoundVar(1), BoundVar(1)))
+    conj = App(App(Const("and"), Const("p")), Lam("x", BoundVar(0)))
+    assert normalize(App(conj, Const("c"))) == \
+        App(App(Const("and"), App(Const("p"), Const("c"))), Const("c"))
+
+
+def test_interning():
+    term = App(Const("f"), Lam("x", App(Const("g"), BoundVar(0))))
+    assert App(Const("f"), Lam("x", App(Const("g"), BoundVar(0)))) is term
+    other = App(Const("f"), Lam("y", App(Const("g"), BoundVar(0))))
+    assert other is not term and other == term
+    assert hash(other) == hash(term) and str(other) != str(term)
+    assert pickle.loads(pickle.dumps(term)) is term
+
+
 def test_deBruijn():
     assert Lam("x", FreeVar("x")).deBruijn() == Lam("x", BoundVar(0))
     assert Lam
@@ -226,4 +534,6 @@ def test_deBruijn():
 
 if __name__ == '__main__':
     test_beta()
+    test_normalize()
+    test_interning()
     test_deBruijn()
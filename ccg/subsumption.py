@@ -0,0 +1,61 @@
+"""
+Pruning chart items that are subsumed by more general ones.
+
+If a cell holds an item whose category has metavariables, say X/X,
+and another with the same semantics, built by the same rule, whose
+category is an instance of it, say NP/NP, then whatever the specific
+item combines with, so does the general one (with the metavariables
+bound accordingly); the specific item only multiplies the work done
+in every larger span.
+"""
+
+import category
+import catset
+
+
+def instance_of(specific, general):
+    """Is the closed category specific what general (which may have
+       metavariables) becomes for some values of its metavariables?
+       Only the metavariables count: an item with fewer attributes is
+       not more general, since it fits fewer argument positions."""
+    sub = category.unify(specific, general)
+    return sub is not None and general.subst(sub) == specific
+
+
+class Subsumption:
+    """Removes subsumed items from the cells of the chart (see
+       chartparser.parse), counting how many it drops; use one per
+       parse to count the items dropped in that parse."""
+
+    def __init__(self):
+        self.subsumed = 0
+
+    def prune(self, items):
+        """The items not subsumed by another one, in their original order.
+           Only items with the same final rule, the same semantics and the
+           same slashes along the spine of their categories are compared,
+           and then only the closed ones against the others, found through
+           a catset.DiscriminationTree of the latter."""
+        general = {}
+        for item in items:
+            if not item.cat.closed:
+                tree = general.setdefault(self.key(item),
+                                          catset.DiscriminationTree())
+                tree.insert(item.cat, item)
+        if not general:
+            return list(items)
+        kept = []
+        for item in items:
+            tree = general.get(self.key(item)) if item.cat.closed else None
+            if tree is not None and \
+               any(instance_of(item.cat, other.cat)
+                   for other in tree.unifiable(item.cat)):
+                self.subsumed += 1
+            else:
+                kept.append(item)
+        return kept
+
+    @staticmethod
+    def key(item):
+        return (item.rule(), tuple(sl for sl, _ in item.cat.info.args),
+                item.sem)
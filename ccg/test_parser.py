@@ -6,11 +6,23 @@ Created on Tue May 30 14:13:01 2017
 @author: stone
 """
 
+import bestfirst
 import chartparser
 from category import *
 import catparser
+import combinators
+import gc
+import goalfilter
+from item import Item, Recipe
+import multiprocessing
+import pytest
+import rules
+import scoring
 import slash
+import subsumption
 import sys
+import time
+import weakref
 
 
 def test_words():
@@ -29,7 +41,9 @@ def test_parse():
     assert str(ans[0].sem) == "λx.will(eat(x)(cheese))"
 
 
-def test_lexicon(filename):
+def load_lexicon(filename):
+    """Reads the lexicon and test sentences from the given file,
+       adding a generic coordination entry for 'and'."""
     lexicon_data = open(filename).read().splitlines()
     lexicon, sentences = catparser.do_parses(lexicon_data)
 
@@ -49,12 +63,453 @@ def test_lexicon(filename):
                                            semantics.Const("and"),
                                            semantics.BoundVar(0)),
                                        semantics.BoundVar(1))))))
+    return lexicon, sentences
+
+
+def count_derivations(node):
+    """The number of derivations packed into the given PackedItem"""
+    total = 0
+    for why in node.derivations:
+        if isinstance(why, list):
+            subtotal = 1
+            for child in why[1:]:
+                subtotal *= count_derivations(child)
+            total += subtotal
+        else:
+            total += 1
+    return total
+
+
+def test_packed_parse():
+    lexicon, _ = load_lexicon('g1.txt')
+    wds = chartparser.words('a a b b c c')
+    items, _ = chartparser.parse(wds, lexicon)
+    nodes, chart = chartparser.parse(wds, lexicon, packed=True)
+    assert 0 < len(nodes) < len(items)
+    assert sum(count_derivations(node) for node in nodes) == len(items)
+    for item in items:
+        assert any(node == item and node.rule() == item.rule()
+                   for node in nodes)
+
+
+def test_iter_derivations():
+    lexicon, _ = load_lexicon('g1.txt')
+    wds = chartparser.words('a a b b c c')
+    items, _ = chartparser.parse(wds, lexicon)
+    _, chart = chartparser.parse(wds, lexicon, packed=True)
+    derivations = list(chartparser.iter_derivations(chart))
+    assert sorted(d.strings for d in derivations) == \
+        sorted(item.strings for item in items)
+    assert len(list(chartparser.iter_derivations(chart, S))) == 2
+    assert len(list(chartparser.iter_derivations(chart, S, k=1))) == 1
+    # Without a score, each root's derivations come in turn
+    roots = chart[(0, len(wds) - 1)]
+    order = [next(n for n, root in enumerate(roots)
+                  if root.cat is d.cat and root.sem is d.sem)
+             for d in derivations]
+    assert order == sorted(order)
+
+    def size(item):
+        if isinstance(item.why, list):
+            return 1 + sum(size(child) for child in item.why[1:])
+        return 1
+    sizes = [size(d) for d in chartparser.iter_derivations(
+                chart, score=lambda node, why: 1)]
+    assert sizes == sorted(sizes)
+
+
+def test_indexed_cells():
+    lexicon, sentences = load_lexicon('ssi.txt')
+    for (_, sentence, _, _) in sentences:
+        wds = chartparser.words(sentence)
+        try:
+            chartparser.USE_INDEXES = False
+            items, _ = chartparser.parse(wds, lexicon)
+        finally:
+            chartparser.USE_INDEXES = True
+        indexed_items, _ = chartparser.parse(wds, lexicon)
+        assert sorted(item.strings for item in items) == \
+            sorted(item.strings for item in indexed_items)
+
+
+def test_dispatch_table():
+    table = rules.dispatch_table(rules.parsingRules[1])
+    assert table is rules.dispatch_table(rules.parsingRules[1])
+
+    np = Item(NP, semantics.Const('anna'), 'anna')
+    vbi = Item(VBI, semantics.Const('barks'), 'barks')
+    assert table.rules_for(np.signature, np.signature) == []
+    assert table.rules_for(np.signature, vbi.signature) == \
+        [rules.backward_application]
+
+    raised = []
+    rules.typeraise_simple(np, raised)
+    # NF constraint 5: no forward application of a type-raised functor
+    assert rules.forward_application not in \
+        table.rules_for(raised[0].signature, vbi.signature)
+
+
+def test_best_first():
+    lexicon, sentences = load_lexicon('ssi.txt')
+    for (_, sentence, goal_category, _) in sentences:
+        wds = chartparser.words(sentence)
+        items, _ = chartparser.parse(wds, lexicon)
+        if goal_category is not None:
+            items = [item for item in items
+                     if item.cat.sub_unify(goal_category) is not None]
+        best = list(bestfirst.iter_best(wds, lexicon, goal_category))
+        assert sorted(item.strings for item in items) == \
+            sorted(item.strings for item in best)
+        costs = [scoring.cost(item, scoring.derivation_size)
+                 for item in best]
+        assert costs == sorted(costs)
+        first = bestfirst.parse_best(wds, lexicon, goal_category)
+        assert (first is None) == (items == [])
+        if first is not None:
+            assert scoring.cost(first, scoring.derivation_size) == costs[0]
+
+
+def test_beam():
+    lexicon, sentences = load_lexicon('ssi.txt')
+    for (_, sentence, _, _) in sentences:
+        wds = chartparser.words(sentence)
+        items, _ = chartparser.parse(wds, lexicon)
+        wide, _ = chartparser.parse(wds, lexicon, beam=scoring.Beam())
+        assert sorted(item.strings for item in items) == \
+            sorted(item.strings for item in wide)
+        for packed in [False, True]:
+            beam = scoring.Beam(width=1)
+            _, chart = chartparser.parse(wds, lexicon, packed, beam)
+            assert all(len(cell) <= 1 for cell in chart.values())
+            beam = scoring.Beam(threshold=0)
+            _, chart = chartparser.parse(wds, lexicon, packed, beam)
+            for cell in chart.values():
+                assert len({beam.cost(item) for item in cell}) <= 1
+    # Reusing the beam does not keep the earlier charts alive
+    chart = chartparser.parse(wds, lexicon, True, beam)[1]
+    node = weakref.ref(chart[(0, 0)][0])
+    del chart
+    gc.collect()
+    assert node() is None
+
+
+def test_lexicon(filename):
+    lexicon, sentences = load_lexicon(filename)
     for (label, sentence, category, expected_count) in sentences:
         chartparser.p(label, sentence, lexicon, category, expected_count)
 
 
+def test_parallel_fill():
+    lexicon, sentences = load_lexicon('ssi.txt')
+
+    def summary(chart):
+        return {span: [(str(item.cat), str(item.sem), item.rule())
+                       for item in cell]
+                for span, cell in chart.items()}
+
+    for (_, sentence, _, _) in sentences:
+        wds = chartparser.words(sentence)
+        for packed in [False, True]:
+            _, chart = chartparser.parse(wds, lexicon, packed)
+            _, parallel_chart = chartparser.parse(wds, lexicon, packed,
+                                                  processes=2)
+            assert summary(chart) == summary(parallel_chart)
+            if not packed:
+                # ...down to the instantiated items of each derivation
+                for span, cell in chart.items():
+                    assert [item.strings for item in cell] == \
+                        [item.strings for item in parallel_chart[span]]
+    wds = chartparser.words(sentences[-1][1])
+    items, _ = chartparser.parse(wds, lexicon, True, processes=2)
+    assert sum(count_derivations(item) for item in items) == \
+        len(chartparser.parse(wds, lexicon)[0])
+
+
+def test_chart_session():
+    lexicon, sentences = load_lexicon('ssi.txt')
+    for (_, sentence, _, _) in sentences:
+        wds = chartparser.words(sentence)
+        session = chartparser.ChartSession(lexicon)
+        for n, word in enumerate(wds):
+            items = session.push(word)
+            expected, _ = chartparser.parse(wds[:n + 1], lexicon)
+            assert sorted(item.strings for item in items) == \
+                sorted(item.strings for item in expected)
+        assert len(list(session.derivations())) == len(items)
+
+    # An unknown word is refused without disturbing the session
+    session = chartparser.ChartSession()
+    session.push('fido')
+    with pytest.raises(KeyError):
+        session.push('zzz')
+    items = session.push('barks')
+    expected, _ = chartparser.parse(['fido', 'barks'])
+    assert session.words == ['fido', 'barks']
+    assert [(item.cat, item.sem) for item in items] == \
+        [(item.cat, item.sem) for item in expected]
+
+
+def test_goal_filter():
+    lexicon, sentences = load_lexicon('g1.txt')
+    for (_, sentence, _, _) in sentences:
+        wds = chartparser.words(sentence)
+        items, chart = chartparser.parse(wds, lexicon)
+        for goal in {item.cat for cell in chart.values() for item in cell}:
+            expected = [item for item in items
+                        if item.cat.sub_unify(goal) is not None]
+            found, _ = chartparser.parse(wds, lexicon, goal_category=goal)
+            assert sorted(item.strings for item in expected) == \
+                sorted(item.strings for item in found)
+
+    # Nothing takes an S argument, so S\NP cannot help build an NP
+    goal_filter = goalfilter.GoalFilter(NP, [NP, VBI])
+    assert not goal_filter.admits(Item(VBI, semantics.Const('x'), 'x'))
+    assert goal_filter.admits(Item(NP, semantics.Const('y'), 'y'))
+
+
+def test_combination_cache():
+    lexicon, sentences = load_lexicon('g1.txt')
+    wds = chartparser.words(sentences[0][1])
+    combinators.cache_clear()
+    items, _ = chartparser.parse(wds, lexicon)
+    misses = combinators.cache_info().misses
+    # Parsing the same sentence again finds every closed combination
+    # in the cache, and gives the same results.
+    again, _ = chartparser.parse(wds, lexicon)
+    assert combinators.cache_info().misses == misses
+    assert combinators.cache_info().hits > 0
+    assert [item.strings for item in again] == [item.strings for item in items]
+
+    combination = combinators.compose(VBI, NP)
+    assert combination == (S, None)
+    assert combinators.compose(VBI, S) is None
+
+
+def test_subsumption():
+    mv = Metavar("X")
+    general = Item(SlashCategory(mv, slash.RSLASH, mv),
+                   semantics.Const('f'), 'w')
+    specific = Item(SlashCategory(NP, slash.RSLASH, NP),
+                    semantics.Const('f'), 'w')
+    other_sem = Item(SlashCategory(NP, slash.RSLASH, NP),
+                     semantics.Const('g'), 'w')
+    other_cat = Item(SlashCategory(S, slash.RSLASH, NP),
+                     semantics.Const('f'), 'w')
+    pruner = subsumption.Subsumption()
+    items = [specific, other_sem, general, other_cat]
+    assert pruner.prune(items) == [other_sem, general, other_cat]
+    assert pruner.subsumed == 1
+
+    # Nothing in g1.txt is subsumed, so its parses are unchanged
+    lexicon, sentences = load_lexicon('g1.txt')
+    for (_, sentence, _, _) in sentences:
+        wds = chartparser.words(sentence)
+        expected, _ = chartparser.parse(wds, lexicon)
+        for processes in [1, 2]:
+            pruner = subsumption.Subsumption()
+            found, _ = chartparser.parse(wds, lexicon, processes=processes,
+                                         subsumption=pruner)
+            assert pruner.subsumed == 0
+            assert [item.strings for item in found] == \
+                [item.strings for item in expected]
+
+    # ...whereas here "a dogs" is both X/X and NP/NP, with the same
+    # semantics, and the parses that used the latter go
+    a = semantics.Const('a')
+    lexicon = {'a': [(SlashCategory(SlashCategory(mv, slash.RSLASH, mv),
+                                    slash.RSLASH, NP),
+                      semantics.Lam('y', semantics.App(
+                          a, semantics.BoundVar(0)))),
+                     (SlashCategory(SlashCategory(NP, slash.RSLASH, NP),
+                                    slash.RSLASH, NP),
+                      a)],
+               'dogs': [(NP, semantics.Const('dogs'))],
+               'cats': [(NP, semantics.Const('cats'))]}
+    wds = ['a', 'dogs', 'cats']
+    expected, _ = chartparser.parse(wds, lexicon)
+    for processes in [1, 2]:
+        pruner = subsumption.Subsumption()
+        found, _ = chartparser.parse(wds, lexicon, processes=processes,
+                                     subsumption=pruner)
+        assert 0 < len(found) < len(expected)
+        assert {str(item.sem) for item in found} == \
+            {str(item.sem) for item in expected}
+        assert pruner.subsumed == 1
+
+
+def test_lazy_semantics():
+    def unused():
+        raise AssertionError('semantics built too soon')
+
+    lexicon, sentences = load_lexicon('g1.txt')
+    try:
+        rules.LAZY_SEMANTICS = True
+        # The rules only look at the categories...
+        dest = []
+        rules.forward_application(Item(VBT, Recipe(unused), 'w'),
+                                  Item(NP, semantics.Const('x'), 'x'),
+                                  dest)
+        assert [item.cat for item in dest] == [VBI]
+        # ...and the semantics, when read, are as if built right away
+        for (_, sentence, _, _) in sentences:
+            wds = chartparser.words(sentence)
+            found, _ = chartparser.parse(wds, lexicon)
+            rules.LAZY_SEMANTICS = False
+            expected, _ = chartparser.parse(wds, lexicon)
+            rules.LAZY_SEMANTICS = True
+            assert [item.strings for item in found] == \
+                [item.strings for item in expected]
+    finally:
+        rules.LAZY_SEMANTICS = False
+
+
+def test_recognize():
+    lexicon, sentences = load_lexicon('ssi.txt')
+    for (_, sentence, _, _) in sentences:
+        wds = chartparser.words(sentence)
+        items, chart = chartparser.parse(wds, lexicon)
+        found, recognized = chartparser.parse(wds, lexicon, recognize=True)
+        assert chartparser.span_categories(recognized) == \
+            chartparser.span_categories(chart)
+        assert bool(found) == bool(items)
+        assert len(found) <= len(items)
+        assert all(item.sem is None for item in found)
+    # ...also in parallel
+    _, parallel_chart = chartparser.parse(wds, lexicon, processes=2,
+                                          recognize=True)
+    assert chartparser.span_categories(parallel_chart) == \
+        chartparser.span_categories(chart)
+    # ...and with lazy semantics, which the recognized items still lack,
+    # and whose whys still hold no other items
+    try:
+        rules.LAZY_SEMANTICS = True
+        _, lazy_chart = chartparser.parse(wds, lexicon, recognize=True)
+    finally:
+        rules.LAZY_SEMANTICS = False
+    assert chartparser.span_categories(lazy_chart) == \
+        chartparser.span_categories(chart)
+    for cell in lazy_chart.values():
+        for item in cell:
+            assert not item.has_sem
+            assert isinstance(item.why, str) or len(item.why) == 1
+
+
+def test_count_parses():
+    lexicon, _ = load_lexicon('g1.txt')
+    wds = chartparser.words('a a b b c c')
+    items, _ = chartparser.parse(wds, lexicon)
+    nodes, _ = chartparser.parse(wds, lexicon, packed=True)
+    assert [node.count for node in nodes] == \
+        [count_derivations(node) for node in nodes]
+    counts = chartparser.count_parses(wds, lexicon)
+    assert sum(counts.values()) == len(items)
+    assert set(counts) == {(item.cat, item.sem) for item in items}
+
+    # Each bracketing of a coordination is a different reading, so
+    # n verbs have Catalan(n-1) of them
+    lexicon, _ = load_lexicon('ssi.txt')
+    for n, catalan in enumerate([1, 1, 2, 5, 14, 42, 132, 429], 1):
+        wds = chartparser.words(
+            'keats ' + ' and '.join(['cooked'] * n) + ' apples')
+        counts = chartparser.count_parses(wds, lexicon)
+        assert sum(counts.values()) == catalan
+        assert set(counts.values()) == {1}
+        if n < 5:
+            assert len(chartparser.parse(wds, lexicon)[0]) == catalan
+
+
+def test_batch_lexicon():
+    global worker_lexicon, worker_sentences
+    results = batch_lexicon('ssi.txt', processes=2)
+    saved = worker_lexicon, worker_sentences
+    try:
+        init_worker('ssi.txt')
+        expected = [check_sentence(n) for n in range(len(worker_sentences))]
+        assert [(label, sentence, count, ok, error)
+                for (label, sentence, count, _, ok, error) in results] == \
+            [(label, sentence, count, ok, error)
+             for (label, sentence, count, _, ok, error) in expected]
+        # 71. "Keats cooked and ate apples" has the one parse it should
+        assert worker_sentences[3][:2] == \
+            ('71.', 'keats cooked and ate apples')
+        assert worker_sentences[3][3] == 1
+        assert results[3][2] == 1 and results[3][4]
+
+        # An error in the parser is reported as a failure, not raised
+        worker_lexicon['xyzzy'] = [None]
+        worker_sentences.append(('0.', 'keats eats xyzzy', None, 1))
+        label, _, count, _, ok, error = \
+            check_sentence(len(worker_sentences) - 1)
+        assert (label, count, ok) == ('0.', None, False)
+        assert error.startswith('TypeError')
+    finally:
+        worker_lexicon, worker_sentences = saved
+
+
+# The lexicon and sentences of a batch worker (see batch_lexicon)
+worker_lexicon = None
+worker_sentences = None
+
+
+def init_worker(filename):
+    global worker_lexicon, worker_sentences
+    worker_lexicon, worker_sentences = load_lexicon(filename)
+
+
+def check_sentence(n):
+    """Counts the parses of the n-th test sentence of the worker's
+       lexicon file, returning (label, sentence, count, seconds, ok,
+       error). If the parser fails (e.g., with a KeyError for a word
+       missing from the lexicon), count is None, ok is False and
+       error describes the exception; otherwise error is None."""
+    label, sentence, category, expected_count = worker_sentences[n]
+    start = time.perf_counter()
+    try:
+        counts = chartparser.count_parses(chartparser.words(sentence),
+                                          worker_lexicon)
+        count = sum(k for (cat, _), k in counts.items()
+                    if category is None or
+                    cat.sub_unify(category) is not None)
+    except Exception as e:
+        return (label, sentence, None, time.perf_counter() - start, False,
+                f'{type(e).__name__}: {e}')
+    ok = expected_count is None or expected_count == count
+    return (label, sentence, count, time.perf_counter() - start, ok, None)
+
+
+def batch_lexicon(filename, processes=None):
+    """Parses all the test sentences of the given lexicon file with a
+       pool of worker processes (by default, one per core), each of
+       which reads the lexicon once. Unlike test_lexicon, it carries
+       on past failures, and returns the results of check_sentence
+       in the order of the file."""
+    _, sentences = load_lexicon(filename)
+    with multiprocessing.Pool(processes, init_worker, (filename,)) as pool:
+        return pool.map(check_sentence, range(len(sentences)))
+
+
+def report(filename, results):
+    failures = 0
+    for label, sentence, count, seconds, ok, error in results:
+        if not ok:
+            failures += 1
+        line = f'{"" if ok else "FAIL"}\t{label}\t{sentence}\t' \
+               f'{"?" if count is None else count}\t{seconds*1000:.1f}ms'
+        if error is not None:
+            line += f'\t{error}'
+        print(line)
+    print(f'{filename}: {len(results) - failures} passed, '
+          f'{failures} failed')
+    return failures
+
+
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+        failures = 0
+        for filename in sys.argv[2:] or ['lexicon.txt']:
+            failures += report(filename, batch_lexicon(filename))
+        exit(1 if failures else 0)
+    elif len(sys.argv) > 1:
         for filename in sys.argv[1:]:
             test_lexicon(filename)
     else:
@@ -1,6 +1,7 @@
 import catparser
 import category
 import collections
+import combinators
 import math
 import random
 import slash
@@ -105,12 +106,14 @@ class CCGrammar:
            application might be possible(in the appropriate order,
            depending on the direction of the functor's slash)"""
         if isinstance(potential_functor, category.SlashCategory):
-            sub = potential_argument.sub_unify(potential_functor.dom)
-            if sub is not None:
+            combination = combinators.compose(potential_functor,
+                                              potential_argument)
+            if combination is not None:
+                lhs, sub = combination
                 functor = potential_functor.subst(sub)
                 argument = potential_argument.subst(sub)
                 direction = functor.slash.dir,
-                lhs = functor.cod.subst(sub)
+                lhs = lhs.subst(sub)
                 if functor.slash.dir in [slash.LEFT, slash.UNDIRECTED]:
                     self.__rules.append(Rule(lhs, [argument, functor]))
                     self.__catmap_binary[lhs].append((argument, functor))